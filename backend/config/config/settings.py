@@ -46,6 +46,7 @@ INSTALLED_APPS = [
     "django.contrib.contenttypes",
     "django.contrib.sessions",
     "django.contrib.messages",
+    "django.contrib.postgres",
     "cloudinary_storage",
     "django.contrib.staticfiles",
     "cloudinary",
@@ -119,7 +120,7 @@ REST_FRAMEWORK = {
         # Any other parsers
     ),
     "EXCEPTION_HANDLER": "music_player_api.utils.custom_exception_handler",
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
+    "DEFAULT_PAGINATION_CLASS": "music_player_api.pagination.CatalogPagination",
     "PAGE_SIZE": 10,
 }
 
@@ -219,6 +220,46 @@ MEDIA_URL = "/music_player_api/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 UPLOAD_ROOT = env_config.get("UPLOAD_ROOT")
 
+# Local copies of fresh uploads handed to background jobs, has to be shared
+# between the API and the job workers
+MEDIA_SPOOL_ROOT = BASE_DIR / "spool"
+
+# Serving of media through the API. With local storage the transfer can be
+# handed over to the front web server with "X-Accel-Redirect" (nginx, files
+# exposed under MEDIA_OFFLOAD_PREFIX as an internal location) or "X-Sendfile"
+MEDIA_OFFLOAD_HEADER = env_config.get("MEDIA_OFFLOAD_HEADER", default=None)
+MEDIA_OFFLOAD_PREFIX = "/protected-media/"
+MEDIA_STREAM_CHUNK_SIZE = 64 * 1024
+# Hand out expiring URLs signed by the API, served through it, instead of
+# the storage URLs; they stay valid for at least MEDIA_URL_TTL seconds
+MEDIA_SIGNED_URLS = False
+MEDIA_URL_TTL = 60 * 60
+
+# Chunked uploads not completed within this time are discarded
+UPLOAD_SESSION_TTL = timedelta(days=1)
+UPLOAD_CHUNK_MAX_SIZE = 2 * 1024 * 1024
+
+# Files no longer in use are deleted in batches by a background job
+MEDIA_SWEEP_BATCH_SIZE = 500
+# Rows deleted per transaction when removing accounts and songs in bulk
+DELETION_BATCH_SIZE = 200
+
+# Downscaled copies of song covers, longest edge in pixels
+COVER_DERIVATIVE_SIZES = [64, 150, 300, 600]
+COVER_DERIVATIVE_FORMATS = ["WEBP", "JPEG"]
+
+# HLS renditions of song audio, AAC bitrates in kbps
+FFMPEG_BINARY = env_config.get("FFMPEG_BINARY", default="ffmpeg")
+AUDIO_RENDITION_BITRATES = [64, 128, 192]
+HLS_SEGMENT_SECONDS = 6
+# ffmpeg processes run at once by a single job worker
+TRANSCODE_MAX_PROCESSES = 2
+TRANSCODE_TIMEOUT = 15 * 60
+
+# Waveform peaks of song audio, one byte per bucket
+WAVEFORM_BUCKETS = 1000
+WAVEFORM_SAMPLE_RATE = 8000
+
 # DEFAULT_FILE_STORAGE = "storages.backends.s3boto3.S3Boto3Storage"
 # STATICFILES_STORAGE = "storages.backends.s3boto3.S3Boto3Storage"
 
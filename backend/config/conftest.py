@@ -1,10 +1,93 @@
+from io import BytesIO
+
 import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
 from pytest_factoryboy import register
 
-from tests.factories import UserFactory
+from tests.factories import (
+    GenreFactory,
+    PlaylistFactory,
+    SongFactory,
+    SongPlaylistFactory,
+    UserFactory,
+)
 
 
 # register(UserFactory)
 @pytest.fixture
 def user_factory():
     return UserFactory
+
+
+@pytest.fixture
+def genre_factory():
+    return GenreFactory
+
+
+@pytest.fixture
+def song_factory():
+    return SongFactory
+
+
+@pytest.fixture
+def playlist_factory():
+    return PlaylistFactory
+
+
+@pytest.fixture
+def song_playlist_factory():
+    return SongPlaylistFactory
+
+
+@pytest.fixture
+def auth_headers(client):
+    """Return a callable building JWT auth headers for the given user."""
+
+    def _auth_headers(user):
+        password = "Secret-password-123"
+        user.set_password(password)
+        user.save()
+        access_token = client.post(
+            "/api/auth/get-token/", {"email": user.email, "password": password}
+        ).json()["access"]
+        return {"HTTP_AUTHORIZATION": f"JWT {access_token}"}
+
+    return _auth_headers
+
+
+@pytest.fixture
+def local_storage(settings, tmp_path):
+    """Store uploaded media on the local filesystem instead of Cloudinary."""
+    settings.DEFAULT_FILE_STORAGE = "django.core.files.storage.FileSystemStorage"
+    settings.MEDIA_ROOT = tmp_path / "media"
+    settings.UPLOAD_ROOT = "uploads"
+    settings.MEDIA_SPOOL_ROOT = tmp_path / "spool"
+    return settings.MEDIA_ROOT
+
+
+@pytest.fixture
+def audio_upload():
+    """Return a callable building an MP3 upload of silent 128 kbps frames,
+    about 26 ms each."""
+
+    def _audio_upload(name="song.mp3", frames=300):
+        content = (
+            b"ID3\x03\x00\x00\x00\x00\x00\x00"
+            + (b"\xff\xfb\x90\x64" + b"\x00" * 413) * frames
+        )
+        return SimpleUploadedFile(name, content, content_type="audio/mpeg")
+
+    return _audio_upload
+
+
+@pytest.fixture
+def image_upload():
+    """Return a callable building an image upload of the given size."""
+
+    def _image_upload(name="cover.png", size=(600, 400), image_format="PNG"):
+        buffer = BytesIO()
+        Image.new("RGB", size, color=(200, 30, 30)).save(buffer, image_format)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    return _image_upload
@@ -1,9 +1,21 @@
 from django.contrib import admin
 
-from music_player_api.models import Genre, Playlist, Song, SongPlaylist, User
+from music_player_api.models import (
+    DeletedFile,
+    Genre,
+    Job,
+    MediaBlob,
+    Playlist,
+    Song,
+    SongPlaylist,
+    User,
+)
 
 admin.site.register(User)
 admin.site.register(Song)
 admin.site.register(SongPlaylist)
 admin.site.register(Playlist)
 admin.site.register(Genre)
+admin.site.register(Job)
+admin.site.register(MediaBlob)
+admin.site.register(DeletedFile)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MusicPlayerApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "music_player_api"
+
+    def ready(self):
+        # register background job handlers
+        from music_player_api import tasks  # noqa: F401
@@ -0,0 +1,25 @@
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.settings import api_settings
+
+from music_player_api.search import build_search_query
+
+
+class FullTextSearchFilter(BaseFilterBackend):
+    """Drop-in replacement for SearchFilter backed by PostgreSQL full-text search.
+
+    Keeps the `?search=` contract and delegates matching to the queryset's
+    `search()` method, which annotates `search_rank`. Matches are ordered by
+    relevance first, then by the ordering already applied to the queryset, so
+    this backend should come after OrderingFilter.
+    """
+
+    search_param = api_settings.SEARCH_PARAM
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, "")
+        if not text.strip():
+            return queryset
+        query = build_search_query(text)
+        if query is None:
+            return queryset.none()
+        return queryset.search(query).order_by("-search_rank", *queryset.query.order_by)
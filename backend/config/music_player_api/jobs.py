@@ -0,0 +1,170 @@
+"""A small job queue backed by the database.
+
+Jobs are rows of the Job model, so the queue needs nothing besides
+PostgreSQL and jobs enqueued inside a transaction only become visible when
+it commits. Workers (`manage.py run_jobs`) claim jobs with
+SELECT ... FOR UPDATE SKIP LOCKED and hold a lease on them, renewed for as
+long as the job runs; jobs of a crashed worker are picked up again once their
+lease expires.
+Handlers are registered with the `job` decorator, see music_player_api.tasks.
+"""
+import logging
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from music_player_api.models import Job
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+LEASE = timedelta(minutes=10)
+LEASE_RENEWAL_INTERVAL = LEASE / 3
+RETRY_DELAY = timedelta(seconds=30)
+
+_handlers = {}
+_failure_handlers = {}
+
+
+def job(name, on_failure=None):
+    """Register the decorated function as the handler of jobs called `name`.
+
+    `on_failure` is called with the job payload once the job failed for good,
+    after its last attempt; earlier failures are simply retried.
+    """
+
+    def decorator(func):
+        _handlers[name] = func
+        if on_failure is not None:
+            _failure_handlers[name] = on_failure
+        return func
+
+    return decorator
+
+
+def enqueue(name, **payload):
+    if name not in _handlers:
+        raise ValueError(f"No handler registered for job '{name}'.")
+    return Job.objects.create(name=name, payload=payload)
+
+
+def enqueue_many(name, payloads):
+    """Enqueue a job called `name` for each payload with a single query."""
+    if name not in _handlers:
+        raise ValueError(f"No handler registered for job '{name}'.")
+    return Job.objects.bulk_create(
+        [Job(name=name, payload=payload) for payload in payloads]
+    )
+
+
+def claim_next_job():
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            claimed = (
+                Job.objects.select_for_update(skip_locked=True)
+                .filter(
+                    Q(status=Job.Status.PENDING) | Q(status=Job.Status.RUNNING),
+                    run_after__lte=now,
+                )
+                .order_by("run_after", "id")
+                .first()
+            )
+            if claimed is None:
+                return None
+            if (
+                claimed.status == Job.Status.RUNNING
+                and claimed.attempts >= MAX_ATTEMPTS
+            ):
+                # the lease of the last attempt expired, the job probably
+                # takes its worker down (out of memory, killed) every time
+                logger.error("Job %s failed, its lease expired.", claimed)
+                claimed.status = Job.Status.FAILED
+                claimed.last_error = "The lease expired before the job finished."
+                claimed.save(update_fields=["status", "last_error"])
+                job_failed(claimed)
+                continue
+            claimed.status = Job.Status.RUNNING
+            claimed.attempts += 1
+            claimed.run_after = now + LEASE
+            claimed.save(update_fields=["status", "attempts", "run_after"])
+        return claimed
+
+
+def run_job(claimed):
+    """Run a claimed job; finished jobs are deleted, failed ones retried."""
+    try:
+        with renewing_lease(claimed):
+            _handlers[claimed.name](**claimed.payload)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Job %s failed.", claimed)
+        if claimed.attempts < MAX_ATTEMPTS:
+            status = Job.Status.PENDING
+            run_after = timezone.now() + RETRY_DELAY * claimed.attempts
+        else:
+            status = Job.Status.FAILED
+            run_after = claimed.run_after
+        # the row may be gone, or reclaimed by another worker after the lease
+        # expired; then that worker's run decides what happens to the job
+        updated = Job.objects.filter(
+            pk=claimed.pk, status=Job.Status.RUNNING, attempts=claimed.attempts
+        ).update(status=status, run_after=run_after, last_error=traceback.format_exc())
+        if updated and status == Job.Status.FAILED:
+            job_failed(claimed)
+        return False
+    claimed.delete()
+    return True
+
+
+def job_failed(failed):
+    """Run the `on_failure` handler of a job that will not be retried."""
+    on_failure = _failure_handlers.get(failed.name)
+    if on_failure is None:
+        return
+    try:
+        on_failure(**failed.payload)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("The failure handler of job %s failed.", failed)
+
+
+@contextmanager
+def renewing_lease(claimed):
+    """Extend the lease of a claimed job every `LEASE_RENEWAL_INTERVAL` until
+    the block exits, so that jobs running longer than `LEASE` (transcoding)
+    are not reclaimed by another worker while still running."""
+    stopped = threading.Event()
+
+    def renew():
+        try:
+            while not stopped.wait(LEASE_RENEWAL_INTERVAL.total_seconds()):
+                Job.objects.filter(
+                    pk=claimed.pk, status=Job.Status.RUNNING, attempts=claimed.attempts
+                ).update(run_after=timezone.now() + LEASE)
+        finally:
+            # the thread has a connection of its own
+            connection.close()
+
+    renewer = threading.Thread(target=renew, daemon=True)
+    renewer.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        renewer.join()
+
+
+def run_pending_jobs(limit=None):
+    """Run jobs until the queue is empty or `limit` jobs ran; return the count."""
+    count = 0
+    while limit is None or count < limit:
+        claimed = claim_next_job()
+        if claimed is None:
+            break
+        run_job(claimed)
+        count += 1
+    return count
@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage as storage
+from django.core.management.base import BaseCommand
+
+from music_player_api.models import Song
+from music_player_api.utils import read_audio_metadata
+
+METADATA_FIELDS = ["duration", "bitrate", "sample_rate", "codec", "tags"]
+
+
+def read_song_metadata(song):
+    with storage.open(song.audio_file.name, "rb") as audio_file:
+        return read_audio_metadata(audio_file)
+
+
+class Command(BaseCommand):
+    help = "Extract audio metadata of songs stored before it was recorded."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Number of audio files read at once.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=200,
+            help="Number of songs updated per query.",
+        )
+
+    def handle(self, *args, **options):
+        # the codec is set whenever metadata could be read
+        songs = (
+            Song.objects.filter(codec="")
+            .exclude(audio_file="")
+            .exclude(audio_file__isnull=True)
+            .only("id", "audio_file")
+            .order_by("id")
+        )
+        last_id = 0
+        updated = failed = 0
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            while True:
+                batch = list(songs.filter(id__gt=last_id)[: options["batch_size"]])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                futures = [pool.submit(read_song_metadata, song) for song in batch]
+                readable = []
+                for song, future in zip(batch, futures):
+                    try:
+                        metadata = future.result()
+                    except Exception as error:
+                        metadata = {}
+                        self.stderr.write(f"Song {song.id}: {error}")
+                    if not metadata:
+                        failed += 1
+                        continue
+                    for field, value in metadata.items():
+                        setattr(song, field, value)
+                    readable.append(song)
+                Song.objects.bulk_update(readable, METADATA_FIELDS)
+                updated += len(readable)
+        self.stdout.write(f"Updated {updated} song(s), {failed} unreadable.")
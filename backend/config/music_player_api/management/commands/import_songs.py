@@ -0,0 +1,297 @@
+import csv
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.files import File
+from django.core.files.storage import default_storage as storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.serializers import ValidationError
+
+from music_player_api.jobs import enqueue_many
+from music_player_api.models import Genre, MediaBlob, Song, User
+from music_player_api.utils import (
+    AUDIO_EXTENSIONS,
+    THUMBNAIL_SIZE,
+    encode_cover_derivatives,
+    hash_file,
+    read_audio_metadata,
+    store_cover_derivatives,
+    validate_file_size,
+    validate_is_music,
+)
+
+COVER_FILE_NAMES = ["cover.jpg", "cover.jpeg", "cover.png", "folder.jpg"]
+MANIFEST_FIELDS = ["audio", "title", "author", "genres", "lyrics", "cover"]
+
+
+def read_manifest(path):
+    """Tracks listed in a CSV manifest with the `MANIFEST_FIELDS` columns.
+
+    File paths are relative to the manifest and genres separated by ";".
+    Title, author and genres left empty are taken from the audio tags.
+    """
+    root = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as manifest:
+        for row in csv.DictReader(manifest):
+            yield {
+                "key": row["audio"],
+                "audio": os.path.join(root, row["audio"]),
+                "cover": os.path.join(root, row["cover"]) if row.get("cover") else None,
+                "title": row.get("title") or "",
+                "author": row.get("author") or "",
+                "genres": [
+                    name.strip()
+                    for name in (row.get("genres") or "").split(";")
+                    if name.strip()
+                ],
+                "lyrics": row.get("lyrics") or "",
+            }
+
+
+def scan_directory(path):
+    """Tracks of every audio file under `path`, described by their tags, with
+    a cover image found next to them."""
+    for directory, _, filenames in sorted(os.walk(path)):
+        cover = next(
+            (
+                os.path.join(directory, name)
+                for name in COVER_FILE_NAMES
+                if name in filenames
+            ),
+            None,
+        )
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() not in AUDIO_EXTENSIONS:
+                continue
+            audio = os.path.join(directory, filename)
+            yield {
+                "key": os.path.relpath(audio, path),
+                "audio": audio,
+                "cover": cover,
+                "title": "",
+                "author": "",
+                "genres": [],
+                "lyrics": "",
+            }
+
+
+def describe_file(file):
+    return hash_file(file), file.size, os.path.splitext(file.name)[1].lower()
+
+
+def inspect_track(track):
+    """Validate a track and prepare everything that does not need the
+    database or the storage. Runs in the worker processes."""
+    try:
+        with open(track["audio"], "rb") as audio_read:
+            audio_file = File(audio_read)
+            validate_is_music(audio_file)
+            validate_file_size(audio_file)
+            metadata = read_audio_metadata(audio_file)
+            track["audio_blob"] = describe_file(audio_file)
+        track["cover_blob"] = None
+        track["cover_variants"] = {}
+        if track["cover"] is not None:
+            with open(track["cover"], "rb") as cover_read:
+                cover_file = File(cover_read)
+                validate_file_size(cover_file)
+                track["cover_variants"] = encode_cover_derivatives(cover_file)
+                track["cover_blob"] = describe_file(cover_file)
+    except ValidationError as error:
+        track["error"] = str(error.detail[0])
+        return track
+    except Exception as error:  # pylint: disable=broad-except
+        # unreadable files; Pillow raises assorted errors on invalid images
+        track["error"] = f"{type(error).__name__}: {error}"
+        return track
+
+    tags = metadata.get("tags", {})
+    track["title"] = (
+        track["title"]
+        or next(iter(tags.get("title", [])), "")
+        or os.path.splitext(os.path.basename(track["audio"]))[0]
+    )[:100]
+    track["author"] = (
+        track["author"] or next(iter(tags.get("artist", [])), "") or "Unknown"
+    )[:100]
+    track["genres"] = [
+        name[:100] for name in track["genres"] or tags.get("genre", []) if name
+    ]
+    track["metadata"] = metadata
+    return track
+
+
+def save_file(name, path):
+    with open(path, "rb") as content:
+        return storage.save(name, File(content))
+
+
+class Command(BaseCommand):
+    help = (
+        "Import songs from a directory of audio files or a CSV manifest. "
+        "Progress is recorded, so an interrupted import can be run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="Directory or CSV manifest.")
+        parser.add_argument(
+            "--user", required=True, help="Email of the user adding the songs."
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of processes validating files and encoding covers.",
+        )
+        parser.add_argument(
+            "--uploads",
+            type=int,
+            default=8,
+            help="Number of files transferred to the storage at once.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=200,
+            help="Number of songs created per transaction.",
+        )
+        parser.add_argument(
+            "--progress-file",
+            help="File recording the imported tracks, <source>.progress " "by default.",
+        )
+
+    def handle(self, *args, **options):
+        source = options["source"]
+        try:
+            self.user = User.objects.get(email=options["user"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user with email '{options['user']}'.")
+        if os.path.isdir(source):
+            tracks = scan_directory(source)
+        elif os.path.isfile(source):
+            tracks = read_manifest(source)
+        else:
+            raise CommandError(f"'{source}' is neither a directory nor a file.")
+
+        progress_path = options["progress_file"] or source.rstrip("/") + ".progress"
+        done = set()
+        if os.path.exists(progress_path):
+            with open(progress_path) as progress:
+                done = {json.loads(line)["key"] for line in progress if line.strip()}
+        tracks = [track for track in tracks if track["key"] not in done]
+        self.stdout.write(
+            f"{len(tracks)} track(s) to import, {len(done)} imported before."
+        )
+
+        self.genres = dict(Genre.objects.values_list("name", "id"))
+        self.imported = self.failed = 0
+        batch_size = options["batch_size"]
+        with ProcessPoolExecutor(
+            max_workers=options["workers"]
+        ) as workers, ThreadPoolExecutor(
+            max_workers=options["uploads"]
+        ) as uploads, open(
+            progress_path, "a"
+        ) as progress:
+            # the next batch is inspected while the previous one is stored
+            in_flight = deque()
+            for start in range(0, len(tracks), batch_size):
+                in_flight.append(
+                    [
+                        workers.submit(inspect_track, track)
+                        for track in tracks[start : start + batch_size]
+                    ]
+                )
+                if len(in_flight) > 1:
+                    self.import_batch(in_flight.popleft(), uploads, progress)
+            while in_flight:
+                self.import_batch(in_flight.popleft(), uploads, progress)
+        self.stdout.write(f"Imported {self.imported} song(s), {self.failed} rejected.")
+
+    def import_batch(self, futures, uploads, progress):
+        tracks = []
+        for future in futures:
+            track = future.result()
+            if "error" in track:
+                self.failed += 1
+                self.stderr.write(f"{track['key']}: {track['error']}")
+            else:
+                tracks.append(track)
+        if not tracks:
+            return
+
+        files, paths = {}, {}
+        for track in tracks:
+            for kind in ("audio", "cover"):
+                if track[f"{kind}_blob"] is None:
+                    continue
+                digest, size, extension = track[f"{kind}_blob"]
+                files.setdefault(digest, [extension, size, 0])[2] += 1
+                paths[digest] = track[kind]
+
+        def save_files(names):
+            stored = uploads.map(
+                lambda digest: save_file(names[digest], paths[digest]), names
+            )
+            return dict(zip(names, stored))
+
+        with transaction.atomic():
+            names = MediaBlob.objects.store_many(
+                {digest: tuple(spec) for digest, spec in files.items()}, save_files
+            )
+            songs = Song.objects.bulk_create(
+                [
+                    Song(
+                        added_by=self.user,
+                        title=track["title"],
+                        author=track["author"],
+                        lyrics=track["lyrics"],
+                        audio_file=names[track["audio_blob"][0]],
+                        cover_img=(
+                            names[track["cover_blob"][0]]
+                            if track["cover_blob"]
+                            else None
+                        ),
+                        **track["metadata"],
+                    )
+                    for track in tracks
+                ]
+            )
+            Genre.songs.through.objects.bulk_create(
+                [
+                    Genre.songs.through(song_id=song.id, genre_id=genre_id)
+                    for song, track in zip(songs, tracks)
+                    for genre_id in {
+                        self.get_genre_id(name) for name in track["genres"]
+                    }
+                ]
+            )
+            Song.objects.filter(
+                pk__in=[song.id for song in songs]
+            ).update_search_vector()
+
+            cover_variants = uploads.map(
+                lambda item: store_cover_derivatives(*item),
+                [(song, track["cover_variants"]) for song, track in zip(songs, tracks)],
+            )
+            for song, variants in zip(songs, cover_variants):
+                song.cover_variants = variants
+                song.thumbnail = variants.get(str(THUMBNAIL_SIZE), {}).get("jpeg")
+            Song.objects.bulk_update(songs, ["cover_variants", "thumbnail"])
+            enqueue_many(
+                "transcode_song_audio", [{"song_id": song.id} for song in songs]
+            )
+
+        for song, track in zip(songs, tracks):
+            progress.write(json.dumps({"key": track["key"], "song": song.id}) + "\n")
+        progress.flush()
+        self.imported += len(songs)
+
+    def get_genre_id(self, name):
+        if name not in self.genres:
+            # a plain create, so that the genre catalog cache is invalidated
+            self.genres[name] = Genre.objects.get_or_create(name=name)[0].id
+        return self.genres[name]
@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from music_player_api.models import (
+    DeletedFile,
+    queue_file_sweep,
+    referenced_media_names,
+)
+from music_player_api.utils import list_stored_files
+
+
+class Command(BaseCommand):
+    help = "Queue the stored media files no row refers to for deletion."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace",
+            type=float,
+            default=24,
+            help="Hours to wait before deleting, so that uploads in progress "
+            "are not caught.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of file names checked per query.",
+        )
+
+    def handle(self, *args, **options):
+        names = list_stored_files(settings.UPLOAD_ROOT)
+        delete_after = timezone.now() + timedelta(hours=options["grace"])
+        orphaned = 0
+        for start in range(0, len(names), options["batch_size"]):
+            batch = set(names[start : start + options["batch_size"]])
+            unused = batch - referenced_media_names(batch)
+            DeletedFile.objects.bulk_create(
+                [DeletedFile(name=name, delete_after=delete_after) for name in unused],
+                ignore_conflicts=True,
+            )
+            orphaned += len(unused)
+        if orphaned:
+            queue_file_sweep(delete_after)
+        self.stdout.write(
+            f"Checked {len(names)} file(s), {orphaned} queued for deletion."
+        )
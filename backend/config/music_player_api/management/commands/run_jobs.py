@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from music_player_api.jobs import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = "Run background jobs from the database queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit as soon as the queue is empty.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=1.0,
+            help="Seconds to wait before polling an empty queue again.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_pending_jobs()
+            if count:
+                self.stdout.write(f"Ran {count} job(s).")
+            if options["once"]:
+                return
+            time.sleep(options["sleep"])
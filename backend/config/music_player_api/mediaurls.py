@@ -0,0 +1,120 @@
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage as storage
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+
+class MediaURLCache:
+    """URLs of stored files by file name.
+
+    Building a URL through the storage backend is repeated for every file of
+    every row of every response, so the results are kept in a small LRU
+    memory per process, backed by the shared cache.
+    """
+
+    __max_size = 10000
+    __ttl = 60 * 60 * 24
+    __urls = OrderedDict()
+    __lock = threading.Lock()
+
+    @classmethod
+    def get_many(cls, names):
+        """Return {name: url} for the given stored file names."""
+        names = set(filter(None, names))
+        expires = signature_expiry() if settings.MEDIA_SIGNED_URLS else None
+        keys = {name: f"media_url:{expires}:{name}" for name in names}
+        urls = {}
+        with cls.__lock:
+            for name in names:
+                url = cls.__urls.get(keys[name])
+                if url is not None:
+                    cls.__urls.move_to_end(keys[name])
+                    urls[name] = url
+        missing = [keys[name] for name in names - urls.keys()]
+        if not missing:
+            return urls
+
+        found = cache.get_many(missing)
+        new = {}
+        for name in names - urls.keys():
+            url = found.get(keys[name])
+            if url is None:
+                url = build_media_url(name, expires)
+                new[keys[name]] = url
+            urls[name] = url
+        if new:
+            timeout = cls.__ttl if expires is None else expires - int(time.time())
+            cache.set_many(new, timeout=timeout)
+        with cls.__lock:
+            for name in names:
+                cls.__urls[keys[name]] = urls[name]
+                cls.__urls.move_to_end(keys[name])
+            while len(cls.__urls) > cls.__max_size:
+                cls.__urls.popitem(last=False)
+        return urls
+
+    @classmethod
+    def get(cls, name):
+        if not name:
+            return None
+        return cls.get_many([name])[name]
+
+    @classmethod
+    def clear(cls):
+        with cls.__lock:
+            cls.__urls.clear()
+
+
+def signature_expiry():
+    """Expiry time of URLs signed now.
+
+    Rounded up to a quarter of `MEDIA_URL_TTL`, so that signed URLs stay the
+    same, and cacheable, for a while.
+    """
+    step = max(settings.MEDIA_URL_TTL // 4, 1)
+    return math.ceil((time.time() + settings.MEDIA_URL_TTL) / step) * step
+
+
+def signature_scope(name):
+    """What a signed URL of the stored file `name` gives access to: the file
+    alone, or the whole directory for HLS renditions, whose playlists refer
+    to the segments and to each other by relative names."""
+    directory = os.path.dirname(name) + "/"
+    hls_directory_re = re.compile(
+        rf"(?:^|/){re.escape(settings.UPLOAD_ROOT)}/songs/\d+/hls/$"
+    )
+    if hls_directory_re.search(directory):
+        return directory
+    return name
+
+
+def media_signature(name, expires):
+    return salted_hmac(
+        "music_player_api.media",
+        f"{signature_scope(name)}:{expires}",
+        algorithm="sha256",
+    ).hexdigest()[:32]
+
+
+def verify_media_signature(name, expires, signature):
+    return expires > time.time() and constant_time_compare(
+        media_signature(name, expires), signature
+    )
+
+
+def build_media_url(name, expires=None):
+    if expires is None:
+        return storage.url(name)
+    prefix = reverse(
+        "signed-media", kwargs={"expires": expires, "signature": "-", "name": "-"}
+    )[:-3]
+    return f"{prefix}{media_signature(name, expires)}/{quote(name)}"
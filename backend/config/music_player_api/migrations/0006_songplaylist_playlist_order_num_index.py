@@ -0,0 +1,19 @@
+# Generated by Django 4.1.13 on 2026-10-16 20:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("music_player_api", "0005_song_thumbnail_alter_genre_songs_and_more"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="songplaylist",
+            index=models.Index(
+                fields=["playlist", "order_num"], name="music_playe_playlis_f7c058_idx"
+            ),
+        ),
+    ]
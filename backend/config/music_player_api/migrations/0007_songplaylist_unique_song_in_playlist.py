@@ -0,0 +1,19 @@
+# Generated by Django 4.1.13 on 2026-10-16 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("music_player_api", "0006_songplaylist_playlist_order_num_index"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="songplaylist",
+            constraint=models.UniqueConstraint(
+                fields=("playlist", "song"), name="unique_song_in_playlist"
+            ),
+        ),
+    ]
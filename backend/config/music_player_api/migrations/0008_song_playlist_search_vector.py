@@ -0,0 +1,66 @@
+# Generated by Django 4.1.13 on 2026-10-16 20:36
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def populate_search_vectors(apps, schema_editor):
+    Song = apps.get_model("music_player_api", "Song")
+    Playlist = apps.get_model("music_player_api", "Playlist")
+    Genre = apps.get_model("music_player_api", "Genre")
+    genre_names = (
+        Genre.songs.through.objects.filter(song_id=OuterRef("pk"))
+        .values("song_id")
+        .annotate(names=StringAgg("genre__name", " "))
+        .values("names")
+    )
+    Song.objects.update(
+        search_vector=SearchVector("title", weight="A", config="simple")
+        + SearchVector("author", weight="A", config="simple")
+        + SearchVector(Subquery(genre_names), weight="B", config="simple")
+        + SearchVector("lyrics", weight="D", config="simple")
+    )
+    Playlist.objects.update(
+        search_vector=SearchVector("name", weight="A", config="simple")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("music_player_api", "0007_songplaylist_unique_song_in_playlist"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="playlist",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="song",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="playlist",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="music_playe_search__0c885f_gin"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="song",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="music_playe_search__14f1f7_gin"
+            ),
+        ),
+        migrations.RunPython(populate_search_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.1.13 on 2026-10-16 20:38
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("music_player_api", "0008_song_playlist_search_vector"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name="genre",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["name"], name="genre_name_trgm", opclasses=["gin_trgm_ops"]
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="playlist",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["name"], name="playlist_name_trgm", opclasses=["gin_trgm_ops"]
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="song",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["title"], name="song_title_trgm", opclasses=["gin_trgm_ops"]
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="song",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["author"], name="song_author_trgm", opclasses=["gin_trgm_ops"]
+            ),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.1.13 on 2026-10-16 20:40
+
+from django.contrib.postgres.expressions import ArraySubquery
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import Func, OuterRef, TextField, Value
+from django.db.models.functions import Concat
+
+
+def join(array):
+    return Func(array, Value(" "), function="array_to_string", output_field=TextField())
+
+
+def populate_playlist_search_documents(apps, schema_editor):
+    Song = apps.get_model("music_player_api", "Song")
+    Playlist = apps.get_model("music_player_api", "Playlist")
+    Genre = apps.get_model("music_player_api", "Genre")
+    song_texts = ArraySubquery(
+        Song.objects.filter(playlists=OuterRef("pk")).values(
+            text=Concat("title", Value(" "), "author")
+        )
+    )
+    genre_names = ArraySubquery(
+        Genre.objects.filter(songs__playlists=OuterRef("pk")).values("name").distinct()
+    )
+    Playlist.objects.update(
+        search_vector=SearchVector("name", weight="A", config="simple")
+        + SearchVector(join(song_texts), weight="B", config="simple")
+        + SearchVector(join(genre_names), weight="C", config="simple")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("music_player_api", "0009_trigram_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            populate_playlist_search_documents, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-16 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("music_player_api", "0011_job_song_processing_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="song",
+            name="cover_variants",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
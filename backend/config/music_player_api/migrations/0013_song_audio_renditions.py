@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-16 20:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("music_player_api", "0012_song_cover_variants"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="song",
+            name="audio_renditions",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
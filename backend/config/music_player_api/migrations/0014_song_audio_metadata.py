@@ -0,0 +1,60 @@
+# Generated by Django 4.1.13 on 2026-10-16 20:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("music_player_api", "0013_song_audio_renditions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="song",
+            name="bitrate",
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="song",
+            name="codec",
+            field=models.CharField(blank=True, editable=False, max_length=30),
+        ),
+        migrations.AddField(
+            model_name="song",
+            name="duration",
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="song",
+            name="sample_rate",
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="song",
+            name="tags",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="song",
+            index=models.Index(
+                fields=["duration"], name="music_playe_duratio_400683_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="song",
+            index=models.Index(
+                fields=["bitrate"], name="music_playe_bitrate_799338_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="song",
+            index=models.Index(
+                fields=["sample_rate"], name="music_playe_sample__5ab890_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="song",
+            index=models.Index(fields=["codec"], name="music_playe_codec_d5f16b_idx"),
+        ),
+    ]
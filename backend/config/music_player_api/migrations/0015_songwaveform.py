@@ -0,0 +1,31 @@
+# Generated by Django 4.1.13 on 2026-10-16 20:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("music_player_api", "0014_song_audio_metadata"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SongWaveform",
+            fields=[
+                (
+                    "song",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="waveform",
+                        serialize=False,
+                        to="music_player_api.song",
+                    ),
+                ),
+                ("peaks", models.BinaryField()),
+                ("created_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.1.13 on 2026-10-16 21:09
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("music_player_api", "0017_uploadsession"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeletedFile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                (
+                    "delete_after",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="deletedfile",
+            index=models.Index(
+                fields=["delete_after"], name="music_playe_delete__24746b_idx"
+            ),
+        ),
+    ]
@@ -1,21 +1,40 @@
+import functools
+import os
+import re
+import threading
+import uuid
 from io import BytesIO
 
+from django.conf import settings
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
     PermissionsMixin,
 )
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (
+    SearchRank,
+    SearchVectorField,
+    TrigramWordSimilarity,
+)
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage as storage
-from django.db import models
+from django.core.files.uploadedfile import UploadedFile
+from django.db import models, transaction
+from django.db.models.functions import Concat, Greatest
 from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from PIL import Image
 
+from music_player_api.search import playlist_search_vector, song_search_vector
 from music_player_api.utils import (
+    GenreCatalogCache,
+    get_cover_derivative_names,
+    hash_file,
     upload_audio_to,
     upload_avatar_to,
+    upload_blob_to,
     upload_coverimg_to,
     upload_thumbnail_to,
     validate_file_size,
@@ -24,6 +43,51 @@ from music_player_api.utils import (
 
 
 # MODELS
+class StoredFilesTrackingMixin:
+    """Remember the names of the stored files of `tracked_file_fields` as last
+    loaded from or saved to the database, so that receivers can find replaced
+    files without querying the old row."""
+
+    tracked_file_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_file_names()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self._remember_file_names()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._remember_file_names()
+
+    def _remember_file_names(self):
+        deferred = self.get_deferred_fields()
+        self._stored_file_names = {
+            field: getattr(self, field).name
+            for field in self.tracked_file_fields
+            if field not in deferred
+        }
+
+    def stored_file_name(self, field):
+        """Name of the file of `field` currently in the database."""
+        if self._state.adding:
+            return None
+        names = getattr(self, "_stored_file_names", {})
+        if field not in names:
+            # deferred when loaded, or an instance not loaded from the database
+            return (
+                type(self)
+                .objects.filter(pk=self.pk)
+                .values_list(field, flat=True)
+                .first()
+            )
+        return names[field]
+
+
 class UserManager(BaseUserManager):
     """Define a model manager for User model with no username field."""
 
@@ -58,7 +122,7 @@ class UserManager(BaseUserManager):
         return self._create_user(email, password, **extra_fields)
 
 
-class User(AbstractBaseUser, PermissionsMixin):
+class User(StoredFilesTrackingMixin, AbstractBaseUser, PermissionsMixin):
     """Custom User model."""
 
     first_name = models.CharField(_("first name"), max_length=150, blank=True)
@@ -87,6 +151,7 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = []
+    tracked_file_fields = ("avatar",)
 
     objects = UserManager()
 
@@ -98,7 +163,46 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.email
 
 
-class Song(models.Model):
+class SongQuerySet(models.QuerySet):
+    def with_related(self):
+        """Load owners and genre ids in bulk for serialization."""
+        return self.select_related("added_by").prefetch_related("genres")
+
+    def search(self, query):
+        """Filter by a SearchQuery, see `search.build_search_query`."""
+        return self.filter(search_vector=query).annotate(
+            search_rank=SearchRank(models.F("search_vector"), query)
+        )
+
+    def update_search_vector(self):
+        return self.update(search_vector=song_search_vector())
+
+    def suggest(self, text):
+        """Fuzzy prefix matches on title or author, best first."""
+        return (
+            self.annotate(
+                label=Concat("title", models.Value(" - "), "author"),
+                score=Greatest(
+                    TrigramWordSimilarity(text, "title"),
+                    TrigramWordSimilarity(text, "author"),
+                ),
+            )
+            .filter(
+                models.Q(title__trigram_word_similar=text)
+                | models.Q(author__trigram_word_similar=text)
+            )
+            .order_by("-score", "id")
+            .values("id", "label", "score")
+        )
+
+
+class Song(StoredFilesTrackingMixin, models.Model):
+    class ProcessingStatus(models.TextChoices):
+        PENDING = "pending", _("pending")
+        PROCESSING = "processing", _("processing")
+        READY = "ready", _("ready")
+        FAILED = "failed", _("failed")
+
     added_by = models.ForeignKey(
         to=User, on_delete=models.CASCADE, null=False, related_name="songs"
     )
@@ -123,19 +227,91 @@ class Song(models.Model):
         null=True,
         validators=[validate_file_size],
     )
+    # technical metadata of the audio file, see utils.read_audio_metadata
+    duration = models.FloatField(null=True, blank=True, editable=False)
+    bitrate = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    sample_rate = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    codec = models.CharField(max_length=30, blank=True, editable=False)
+    tags = models.JSONField(default=dict, blank=True, editable=False)
+    # {"<size>": {"<format>": file name}}, see utils.make_cover_derivatives
+    cover_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # {"master": name, "renditions": {"<bitrate>": name}, "files": [...]},
+    # produced by the "transcode_song_audio" job
+    audio_renditions = models.JSONField(default=dict, blank=True, editable=False)
+    # derived media (cover variants, thumbnail) is produced by the
+    # "process_song_media" job
+    processing_status = models.CharField(
+        max_length=10,
+        choices=ProcessingStatus.choices,
+        default=ProcessingStatus.READY,
+    )
+    # title, author, genre names and lyrics, kept up to date by signal receivers
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = SongQuerySet.as_manager()
+    tracked_file_fields = ("cover_img",)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["search_vector"]),
+            GinIndex(
+                name="song_title_trgm", fields=["title"], opclasses=["gin_trgm_ops"]
+            ),
+            GinIndex(
+                name="song_author_trgm", fields=["author"], opclasses=["gin_trgm_ops"]
+            ),
+            models.Index(fields=["duration"]),
+            models.Index(fields=["bitrate"]),
+            models.Index(fields=["sample_rate"]),
+            models.Index(fields=["codec"]),
+        ]
 
     def __str__(self):
         return f"{self.id}: {self.title}; Author: {self.author}"
 
 
+class NameSuggestQuerySet(models.QuerySet):
+    def suggest(self, text):
+        """Fuzzy prefix matches on name, best first."""
+        return (
+            self.annotate(
+                label=models.F("name"), score=TrigramWordSimilarity(text, "name")
+            )
+            .filter(name__trigram_word_similar=text)
+            .order_by("-score", "id")
+            .values("id", "label", "score")
+        )
+
+
 class Genre(models.Model):
     name = models.CharField(blank=False, null=False, max_length=100, unique=True)
     songs = models.ManyToManyField(to=Song, related_name="genres", blank=True)
 
+    objects = NameSuggestQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(
+                name="genre_name_trgm", fields=["name"], opclasses=["gin_trgm_ops"]
+            )
+        ]
+
     def __str__(self):
         return f"{self.id}: {self.name}"
 
 
+class PlaylistQuerySet(NameSuggestQuerySet):
+    def search(self, query):
+        """Match playlists by name or by the titles, authors and genres of
+        their songs, all found in the denormalized search_vector."""
+        return self.filter(search_vector=query).annotate(
+            search_rank=SearchRank(models.F("search_vector"), query)
+        )
+
+    def update_search_vector(self):
+        return self.update(search_vector=playlist_search_vector())
+
+
 class Playlist(models.Model):
     name = models.CharField(blank=False, null=False, max_length=100)
     added_by = models.ForeignKey(
@@ -144,61 +320,509 @@ class Playlist(models.Model):
     songs = models.ManyToManyField(
         to=Song, through="SongPlaylist", related_name="playlists", blank=True
     )
+    # name plus titles, authors and genres of the songs, see
+    # schedule_playlist_search_update
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = PlaylistQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["search_vector"]),
+            GinIndex(
+                name="playlist_name_trgm", fields=["name"], opclasses=["gin_trgm_ops"]
+            ),
+        ]
+
+    def get_ordered_songs(self):
+        """Songs of the playlist annotated with `order_num`, ordered by the DB."""
+        return (
+            Song.objects.filter(songplaylist__playlist=self)
+            .annotate(order_num=models.F("songplaylist__order_num"))
+            .with_related()
+            .order_by("order_num")
+        )
+
+    def get_duration(self):
+        """Total length of the songs in seconds, songs of unknown length aside."""
+        return Song.objects.filter(songplaylist__playlist=self).aggregate(
+            duration=models.Sum("duration")
+        )["duration"]
 
     def __str__(self):
         return f"{self.id}: {self.name}"
 
 
 class SongPlaylist(models.Model):
+    # order_num values are sparse so that a song can be placed between two
+    # others by writing a single row; see PlaylistOperationsSerializer
+    ORDER_GAP = 1024
+
     song = models.ForeignKey(to=Song, on_delete=models.CASCADE)
     playlist = models.ForeignKey(to=Playlist, on_delete=models.CASCADE)
     order_num = models.IntegerField(null=False)  # order id of song in playlist
 
+    class Meta:
+        indexes = [models.Index(fields=["playlist", "order_num"])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["playlist", "song"], name="unique_song_in_playlist"
+            )
+        ]
+
     def __str__(self):
         return f"{self.id}: {self.song.name}; {self.playlist.name}"
 
 
+class SongWaveform(models.Model):
+    """Peaks of the song audio for drawing its waveform, one byte (0-255) per
+    equal slice of the track. Kept apart from `Song` so that song queries do
+    not load it."""
+
+    song = models.OneToOneField(
+        to=Song, on_delete=models.CASCADE, primary_key=True, related_name="waveform"
+    )
+    peaks = models.BinaryField()
+    created_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Waveform of {self.song_id}"
+
+
+class MediaBlobQuerySet(models.QuerySet):
+    def store(self, file):
+        """Store the contents of `file` once and return the storage name.
+
+        Files are keyed by their SHA-256, so an upload identical to a stored
+        one is not transferred again, it only gains a reference. Every call
+        has to be balanced by a `release` of the returned name.
+        """
+        digest = hash_file(file)
+        extension = os.path.splitext(file.name)[1].lower()
+        with transaction.atomic():
+            blob, _ = self.get_or_create(
+                sha256=digest,
+                defaults={"name": upload_blob_to(digest, extension), "size": file.size},
+            )
+            # the row lock serializes concurrent uploads of the same content
+            blob = self.select_for_update().get(pk=blob.pk)
+            if blob.ref_count == 0:
+                # storages may store the file under another name
+                blob.name = storage.save(blob.name, file)
+                blob.save(update_fields=["name"])
+            self.filter(pk=blob.pk).update(ref_count=models.F("ref_count") + 1)
+        return blob.name
+
+    def store_many(self, files, save_files):
+        """Bulk version of `store` for files whose SHA-256 is already known.
+
+        `files` maps digests to (extension, size, number of references to
+        add). Contents without a blob are saved by `save_files`, called with
+        {digest: name} and returning {digest: stored name}, so that the caller
+        can transfer them concurrently. Returns {digest: stored name}.
+        """
+        names = {}
+        with transaction.atomic():
+            while len(names) < len(files):
+                pending = {
+                    digest: spec
+                    for digest, spec in files.items()
+                    if digest not in names
+                }
+                known = set(
+                    self.filter(sha256__in=pending).values_list("sha256", flat=True)
+                )
+                saved = save_files(
+                    {
+                        digest: upload_blob_to(digest, extension)
+                        for digest, (extension, _, _) in pending.items()
+                        if digest not in known
+                    }
+                )
+                self.bulk_create(
+                    [
+                        self.model(sha256=digest, name=name, size=pending[digest][1])
+                        for digest, name in saved.items()
+                    ],
+                    ignore_conflicts=True,
+                )
+                blobs = list(self.select_for_update().filter(sha256__in=pending))
+                for blob in blobs:
+                    if blob.sha256 in saved and blob.name != saved[blob.sha256]:
+                        # stored concurrently by `store`, the copy is not needed
+                        schedule_file_deletion([saved[blob.sha256]])
+                    blob.ref_count += pending[blob.sha256][2]
+                    names[blob.sha256] = blob.name
+                # blobs released in the meantime are stored again on the next pass
+                self.bulk_update(blobs, ["ref_count"])
+        return names
+
+    def release(self, name):
+        """Drop a reference to a stored file, deleting it with the last one.
+
+        Files stored before deduplication have no blob and are deleted
+        right away. Deletion itself is left to `schedule_file_deletion`.
+        """
+        if not name:
+            return
+        with transaction.atomic():
+            blob = self.select_for_update().filter(name=name).first()
+            if blob is None:
+                schedule_file_deletion([name])
+            elif blob.ref_count > 1:
+                self.filter(pk=blob.pk).update(ref_count=models.F("ref_count") - 1)
+            else:
+                blob.delete()
+                schedule_file_deletion([name])
+
+
+class MediaBlob(models.Model):
+    """A stored media file shared by every song that uploaded its contents."""
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = MediaBlobQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} references)"
+
+
+class UploadSession(models.Model):
+    """A file uploaded in chunks, appended to a local file until complete.
+
+    A complete upload is handed to `CreateSongSerializer` by its id instead
+    of a multipart file.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        to=User, on_delete=models.CASCADE, related_name="upload_sessions"
+    )
+    filename = models.CharField(max_length=255)
+    size = models.PositiveIntegerField()
+    # number of bytes received so far
+    offset = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def path(self):
+        return os.path.join(settings.MEDIA_SPOOL_ROOT, "chunked", f"{self.id}.part")
+
+    @property
+    def is_complete(self):
+        return self.offset == self.size
+
+    def append(self, stream, length):
+        """Append `length` bytes read from `stream` at the current offset.
+
+        Returns False, leaving the offset where it was, if the stream ends
+        early.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "ab") as part:
+            part.truncate(self.offset)
+            remaining = length
+            while remaining > 0:
+                chunk = stream.read(min(remaining, 64 * 1024))
+                if not chunk:
+                    return False
+                part.write(chunk)
+                remaining -= len(chunk)
+        self.offset += length
+        self.save(update_fields=["offset"])
+        return True
+
+    def open(self):
+        """The assembled file, to be closed by the caller."""
+        return UploadedFile(open(self.path, "rb"), name=self.filename, size=self.size)
+
+    def __str__(self):
+        return f"{self.filename}: {self.offset}/{self.size}"
+
+
+class DeletedFile(models.Model):
+    """A stored file no longer in use, removed by the "sweep_deleted_files" job."""
+
+    name = models.CharField(max_length=255, unique=True)
+    delete_after = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=["delete_after"])]
+
+    def __str__(self):
+        return self.name
+
+
+class Job(models.Model):
+    """Background job stored in the database, see music_player_api.jobs."""
+
+    class Status(models.TextChoices):
+        PENDING = "pending", _("pending")
+        RUNNING = "running", _("running")
+        FAILED = "failed", _("failed")
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # earliest time to (re)run a pending job; lease expiry of a running one
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "run_after"])]
+
+    def __str__(self):
+        return f"{self.id}: {self.name} ({self.status})"
+
+
 # SIGNAL RECEIVERS
 
 
 @receiver(models.signals.post_delete, sender=User)
 def remove_avatar_on_delete(sender, instance, using, **kwargs):
     if instance.avatar is not None:
-        instance.avatar.delete(save=False)
+        schedule_file_deletion([instance.avatar.name])
     return True
 
 
 @receiver(models.signals.pre_save, sender=User)
-def remove_old_avatar_on_save(sender, instance, using, **kwargs):
-    try:
-        old_instance = User.objects.get(pk=instance.pk)
-    except User.DoesNotExist:
+def remove_old_avatar_on_save(sender, instance, using, update_fields, **kwargs):
+    if update_fields is not None and "avatar" not in update_fields:
         return True
-    if old_instance.avatar is not None and instance.avatar != old_instance.avatar:
-        old_instance.avatar.delete(save=False)
+    old_name = instance.stored_file_name("avatar")
+    if old_name and instance.avatar.name != old_name:
+        schedule_file_deletion([old_name])
     return True
 
 
 @receiver(models.signals.post_delete, sender=Song)
 def remove_audiofile_and_coverimg_on_delete(sender, instance, using, **kwargs):
     if instance.cover_img is not None:
-        instance.cover_img.delete(save=False)
-    if instance.thumbnail is not None:
-        instance.thumbnail.delete(save=False)
+        MediaBlob.objects.release(instance.cover_img.name)
+    schedule_file_deletion(get_cover_derivative_names(instance))
+    schedule_file_deletion(instance.audio_renditions.get("files", []))
     if instance.audio_file is not None:
-        instance.audio_file.delete(save=False)
+        MediaBlob.objects.release(instance.audio_file.name)
     return True
 
 
 @receiver(models.signals.pre_save, sender=Song)
-def remove_old_coverimg_on_save(sender, instance, using, **kwargs):
-    try:
-        old_instance = Song.objects.get(pk=instance.pk)
-    except Song.DoesNotExist:
+def remove_old_coverimg_on_save(sender, instance, using, update_fields, **kwargs):
+    if update_fields is not None and "cover_img" not in update_fields:
         return True
-    if (
-        old_instance.cover_img is not None
-        and instance.cover_img != old_instance.cover_img
+    old_name = instance.stored_file_name("cover_img")
+    if old_name and instance.cover_img.name != old_name:
+        MediaBlob.objects.release(old_name)
+    return True
+
+
+@receiver(models.signals.post_delete, sender=UploadSession)
+def remove_upload_session_file_on_delete(sender, instance, using, **kwargs):
+    if os.path.exists(instance.path):
+        os.remove(instance.path)
+    return True
+
+
+def _on_commit_batched(batches, values, apply):
+    """Call `apply` with `values` once the transaction commits, together with
+    the values of other calls in the same transaction that share `batches`.
+
+    A batch only collects values while its on_commit callback is registered
+    for the current savepoint, so values of a rolled back transaction or
+    savepoint are dropped with their callback instead of joining a later batch.
+    """
+    values = set(values)
+    if not values:
+        return
+    connection = transaction.get_connection()
+    savepoint_ids = set(connection.savepoint_ids)
+    batch = getattr(batches, "current", None)
+    if batch is not None and any(
+        entry[1] is batch and entry[0] == savepoint_ids
+        for entry in connection.run_on_commit
     ):
-        old_instance.cover_img.delete(save=False)
+        batch.args[0].update(values)
+        return
+    batch = batches.current = functools.partial(apply, values)
+    transaction.on_commit(batch)
+
+
+# Stored files are deleted by a background job in batches, so that deletes
+# do not wait for the storage and failed deletions are retried.
+_pending_file_deletions = threading.local()
+
+
+def schedule_file_deletion(names):
+    """Queue the stored files for deletion once the transaction commits."""
+    _on_commit_batched(
+        _pending_file_deletions, [name for name in names if name], _queue_file_deletions
+    )
+
+
+def _queue_file_deletions(names):
+    DeletedFile.objects.bulk_create(
+        [DeletedFile(name=name) for name in names], ignore_conflicts=True
+    )
+    queue_file_sweep()
+
+
+def queue_file_sweep(run_after=None):
+    """Make sure a "sweep_deleted_files" job runs at `run_after` (default now)."""
+    run_after = run_after or timezone.now()
+    # jobs.enqueue is not importable here, the job is registered in tasks
+    if not Job.objects.filter(
+        name="sweep_deleted_files",
+        status=Job.Status.PENDING,
+        run_after__lte=run_after,
+    ).exists():
+        Job.objects.create(name="sweep_deleted_files", run_after=run_after)
+
+
+def referenced_media_names(names):
+    """Those of the stored file names that are still in use."""
+    names = set(names)
+    referenced = set()
+    for model, fields in [
+        (Song, ["audio_file", "cover_img", "thumbnail"]),
+        (User, ["avatar"]),
+        (MediaBlob, ["name"]),
+    ]:
+        for field in fields:
+            referenced.update(
+                model.objects.filter(**{f"{field}__in": names}).values_list(
+                    field, flat=True
+                )
+            )
+    # derived files are kept in JSON fields and stored under the song id; the
+    # storage may prefix the names (Cloudinary prepends its media prefix)
+    song_media_re = re.compile(
+        rf"(?:^|/){re.escape(settings.UPLOAD_ROOT)}/songs/(\d+)/"
+    )
+    song_ids = {
+        int(match.group(1))
+        for match in map(song_media_re.search, names)
+        if match is not None
+    }
+    for song in Song.objects.filter(pk__in=song_ids).only(
+        "cover_variants", "audio_renditions", "thumbnail"
+    ):
+        referenced.update(get_cover_derivative_names(song))
+        referenced.update(song.audio_renditions.get("files", []))
+    return referenced & names
+
+
+# Playlist search vectors depend on many rows, so updates are collected and
+# applied once per transaction instead of once per changed row.
+_pending_playlist_search_updates = threading.local()
+
+
+def schedule_playlist_search_update(playlist_ids):
+    """Recompute search vectors of the given playlists after commit."""
+    _on_commit_batched(
+        _pending_playlist_search_updates, playlist_ids, _update_playlist_search
+    )
+
+
+def _update_playlist_search(playlist_ids):
+    Playlist.objects.filter(pk__in=playlist_ids).update_search_vector()
+
+
+def _playlist_ids_of_songs(song_ids):
+    return SongPlaylist.objects.filter(song_id__in=song_ids).values_list(
+        "playlist_id", flat=True
+    )
+
+
+@receiver(models.signals.post_save, sender=Song)
+def update_song_search_vector_on_save(sender, instance, update_fields, **kwargs):
+    if update_fields is not None and not {"title", "author", "lyrics"} & set(
+        update_fields
+    ):
+        return True
+    Song.objects.filter(pk=instance.pk).update_search_vector()
+    if update_fields is None or {"title", "author"} & set(update_fields):
+        schedule_playlist_search_update(_playlist_ids_of_songs([instance.pk]))
+    return True
+
+
+@receiver(models.signals.m2m_changed, sender=Genre.songs.through)
+def update_song_search_vector_on_genres_change(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    if reverse:
+        # changed through Song.genres, instance is a Song
+        if action not in ("post_add", "post_remove", "post_clear"):
+            return True
+        song_ids = [instance.pk]
+    elif action == "pre_clear":
+        # pk_set is not provided for clear(), remember the songs beforehand
+        instance._cleared_song_ids = list(instance.songs.values_list("pk", flat=True))
+        return True
+    elif action == "post_clear":
+        song_ids = instance._cleared_song_ids
+    elif action in ("post_add", "post_remove"):
+        song_ids = pk_set
+    else:
+        return True
+    Song.objects.filter(pk__in=song_ids).update_search_vector()
+    schedule_playlist_search_update(_playlist_ids_of_songs(song_ids))
+    return True
+
+
+@receiver(models.signals.post_save, sender=Genre)
+def update_song_search_vector_on_genre_save(sender, instance, created, **kwargs):
+    if not created:
+        Song.objects.filter(genres=instance).update_search_vector()
+        schedule_playlist_search_update(
+            SongPlaylist.objects.filter(song__genres=instance).values_list(
+                "playlist_id", flat=True
+            )
+        )
+    return True
+
+
+@receiver(models.signals.pre_delete, sender=Genre)
+def remember_genre_songs_before_delete(sender, instance, **kwargs):
+    instance._deleted_song_ids = list(instance.songs.values_list("pk", flat=True))
+    return True
+
+
+@receiver(models.signals.post_delete, sender=Genre)
+def update_song_search_vector_on_genre_delete(sender, instance, **kwargs):
+    Song.objects.filter(pk__in=instance._deleted_song_ids).update_search_vector()
+    schedule_playlist_search_update(_playlist_ids_of_songs(instance._deleted_song_ids))
+    return True
+
+
+@receiver(models.signals.post_save, sender=Playlist)
+def update_playlist_search_vector_on_save(sender, instance, update_fields, **kwargs):
+    if update_fields is not None and "name" not in update_fields:
+        return True
+    schedule_playlist_search_update([instance.pk])
+    return True
+
+
+@receiver(models.signals.post_save, sender=SongPlaylist)
+@receiver(models.signals.post_delete, sender=SongPlaylist)
+def update_playlist_search_vector_on_songs_change(sender, instance, **kwargs):
+    if kwargs.get("update_fields") == frozenset(["order_num"]):
+        # reordering does not change the search document
+        return True
+    schedule_playlist_search_update([instance.playlist_id])
+    return True
+
+
+@receiver(models.signals.post_save, sender=Genre)
+@receiver(models.signals.post_delete, sender=Genre)
+def bump_genre_catalog_version(sender, instance, **kwargs):
+    # after commit, so that no reader caches the old catalog under the new version
+    transaction.on_commit(GenreCatalogCache.bump_version)
     return True
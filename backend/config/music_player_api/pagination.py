@@ -0,0 +1,47 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class PlaylistTracksPagination(CursorPagination):
+    """Keyset pagination over songs annotated with `order_num`.
+
+    Pages are fetched with `order_num > <cursor position>`, backed by the
+    (playlist, order_num) index, so deep pages cost the same as the first one.
+    """
+
+    ordering = "order_num"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+
+class CatalogCursorPagination(CursorPagination):
+    """Keyset pagination over the catalog's `-id` ordering, without a COUNT."""
+
+    ordering = "-id"
+
+
+class CatalogPagination(PageNumberPagination):
+    """Page number pagination that clients can switch to keyset pagination.
+
+    `?pagination=cursor` (or any `?cursor=`) returns CatalogCursorPagination
+    pages: `next`/`previous` links and no `count`, so page 10,000 is as cheap
+    as page 1. Cursor pages follow the id ordering requested through
+    OrderingFilter, search results are not ordered by relevance there.
+    """
+
+    mode_query_param = "pagination"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (
+            request.query_params.get(self.mode_query_param) == "cursor"
+            or CatalogCursorPagination.cursor_query_param in request.query_params
+        ):
+            self.cursor_paginator = CatalogCursorPagination()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        self.cursor_paginator = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
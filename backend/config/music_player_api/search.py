@@ -0,0 +1,72 @@
+import re
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.expressions import ArraySubquery
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db.models import Func, OuterRef, Subquery, TextField, Value
+from django.db.models.functions import Concat
+
+# "simple" does no stemming or stop-word removal, which suits titles, band
+# names and mixed-language lyrics better than a language dictionary.
+SEARCH_CONFIG = "simple"
+
+
+def build_search_query(text):
+    """Turn user input into a prefix query matching every entered word.
+
+    Returns None if the input contains no searchable words.
+    """
+    terms = re.findall(r"\w+", text or "")
+    if not terms:
+        return None
+    return SearchQuery(
+        " & ".join(f"{term}:*" for term in terms),
+        search_type="raw",
+        config=SEARCH_CONFIG,
+    )
+
+
+def song_search_vector():
+    """Expression computing Song.search_vector, genre names included."""
+    from music_player_api.models import Genre
+
+    genre_names = (
+        Genre.songs.through.objects.filter(song_id=OuterRef("pk"))
+        .values("song_id")
+        .annotate(names=StringAgg("genre__name", " "))
+        .values("names")
+    )
+    return (
+        SearchVector("title", weight="A", config=SEARCH_CONFIG)
+        + SearchVector("author", weight="A", config=SEARCH_CONFIG)
+        + SearchVector(Subquery(genre_names), weight="B", config=SEARCH_CONFIG)
+        + SearchVector("lyrics", weight="D", config=SEARCH_CONFIG)
+    )
+
+
+def playlist_search_vector():
+    """Expression computing Playlist.search_vector.
+
+    The vector is a denormalized search document of the playlist: its name,
+    the titles and authors of its songs and their genre names, so that
+    playlist search never has to join songs or genres.
+    """
+    from music_player_api.models import Genre, Song
+
+    song_texts = ArraySubquery(
+        Song.objects.filter(playlists=OuterRef("pk")).values(
+            text=Concat("title", Value(" "), "author")
+        )
+    )
+    genre_names = ArraySubquery(
+        Genre.objects.filter(songs__playlists=OuterRef("pk")).values("name").distinct()
+    )
+    return (
+        SearchVector("name", weight="A", config=SEARCH_CONFIG)
+        + SearchVector(_join(song_texts), weight="B", config=SEARCH_CONFIG)
+        + SearchVector(_join(genre_names), weight="C", config=SEARCH_CONFIG)
+    )
+
+
+def _join(array):
+    return Func(array, Value(" "), function="array_to_string", output_field=TextField())
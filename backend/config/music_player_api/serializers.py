@@ -4,11 +4,36 @@ import sendgrid
 from django.conf import settings
 from django.contrib.auth.hashers import check_password
 from django.contrib.auth.models import BaseUserManager
+from django.db import models, transaction
+from django.db.models import Max
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer, Serializer, ValidationError
 
-from music_player_api.models import Genre, Playlist, Song, SongPlaylist, User
-from music_player_api.utils import ResetCodeManager, SessionTokenManager, make_thumbnail
+from music_player_api.jobs import enqueue
+from music_player_api.mediaurls import MediaURLCache
+from music_player_api.models import (
+    Genre,
+    MediaBlob,
+    Playlist,
+    Song,
+    SongPlaylist,
+    UploadSession,
+    User,
+    schedule_file_deletion,
+    schedule_playlist_search_update,
+)
+from music_player_api.pagination import PlaylistTracksPagination
+from music_player_api.utils import (
+    MAX_UPLOAD_SIZE,
+    ResetCodeManager,
+    SessionTokenManager,
+    get_cover_derivative_names,
+    read_audio_metadata,
+    remove_spooled,
+    spool_upload,
+)
 
 # User model serializers
 
@@ -179,83 +204,272 @@ class UserInfoSerializer(ModelSerializer):
         )
         read_only_fields = ("email",)
 
-    def save(self, **kwargs):
-        try:
-            if self.validated_data["avatar"] is None:
-                self.instance.avatar.delete(save=False)
-        except KeyError:
-            pass
-        super().save(**kwargs)
-
 
 # Song model serializers
 
 
-class GetFlatSongSerializer(ModelSerializer):
+def get_media_url(name, request=None):
+    """URL of a stored file from `MediaURLCache`, made absolute when the
+    request is known."""
+    url = MediaURLCache.get(name)
+    if url is not None and request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def get_cover_srcset(song, request=None):
+    """URLs of the downscaled covers as {"<size>": {"<format>": url}}."""
+    return {
+        size: {
+            image_format: get_media_url(name, request)
+            for image_format, name in names.items()
+        }
+        for size, names in song.cover_variants.items()
+    }
+
+
+def get_hls(song, request=None):
+    """URLs of the HLS master playlist and of the single bitrate playlists,
+    None until the audio is transcoded."""
+    if not song.audio_renditions:
+        return None
+    return {
+        "master": get_media_url(song.audio_renditions["master"], request),
+        "renditions": {
+            bitrate: get_media_url(name, request)
+            for bitrate, name in song.audio_renditions["renditions"].items()
+        },
+    }
+
+
+def get_song_media_names(song):
+    names = [song.audio_file.name, song.cover_img.name, song.thumbnail.name]
+    for formats in song.cover_variants.values():
+        names.extend(formats.values())
+    if song.audio_renditions:
+        names.append(song.audio_renditions["master"])
+        names.extend(song.audio_renditions["renditions"].values())
+    return names
+
+
+class MediaFileField(serializers.FileField):
+    """Output only file field with the URL resolved through `MediaURLCache`."""
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        return get_media_url(value.name, self.context.get("request"))
+
+
+class SongMediaListSerializer(serializers.ListSerializer):
+    """Resolves the media URLs of all the songs at once."""
+
+    def to_representation(self, data):
+        songs = list(data.all() if isinstance(data, models.Manager) else data)
+        MediaURLCache.get_many(
+            name for song in songs for name in get_song_media_names(song)
+        )
+        return super().to_representation(songs)
+
+
+class SongMediaSerializer(ModelSerializer):
+    serializer_field_mapping = {
+        **ModelSerializer.serializer_field_mapping,
+        models.FileField: MediaFileField,
+        models.ImageField: MediaFileField,
+    }
+
+
+class GetFlatSongSerializer(SongMediaSerializer):
     can_edit = serializers.SerializerMethodField()
+    cover_srcset = serializers.SerializerMethodField()
+    hls = serializers.SerializerMethodField()
     added_by = serializers.StringRelatedField()
 
     class Meta:
         model = Song
+        list_serializer_class = SongMediaListSerializer
         fields = [
             "id",
             "added_by",
             "audio_file",
             "thumbnail",
+            "cover_srcset",
+            "hls",
             "title",
             "author",
             "genres",
+            "duration",
             "can_edit",
         ]
 
+    def get_cover_srcset(self, obj):
+        return get_cover_srcset(obj, self.context.get("request"))
+
+    def get_hls(self, obj):
+        return get_hls(obj, self.context.get("request"))
+
     def get_can_edit(self, obj):
-        return self.context["user"] == obj.added_by
+        return self.context["user"].pk == obj.added_by_id
 
 
-class GetSongSerializer(ModelSerializer):
+class GetSongSerializer(SongMediaSerializer):
     can_edit = serializers.SerializerMethodField()
+    cover_srcset = serializers.SerializerMethodField()
+    hls = serializers.SerializerMethodField()
     added_by = serializers.StringRelatedField()
 
     class Meta:
         model = Song
+        list_serializer_class = SongMediaListSerializer
         fields = [
             "id",
             "added_by",
             "audio_file",
             "cover_img",
             "thumbnail",
+            "cover_srcset",
+            "hls",
             "title",
             "author",
             "genres",
             "lyrics",
+            "duration",
+            "bitrate",
+            "sample_rate",
+            "codec",
+            "tags",
+            "processing_status",
             "can_edit",
         ]
 
+    def get_cover_srcset(self, obj):
+        return get_cover_srcset(obj, self.context.get("request"))
+
+    def get_hls(self, obj):
+        return get_hls(obj, self.context.get("request"))
+
     def get_can_edit(self, obj):
-        return self.context["user"] == obj.added_by
+        return self.context["user"].pk == obj.added_by_id
+
+
+class UploadSessionSerializer(ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ["id", "filename", "size", "offset"]
+        read_only_fields = ["offset"]
+
+    def validate_size(self, value):
+        if value > MAX_UPLOAD_SIZE:
+            raise ValidationError("File is too large. Size should not exceed 10 MB.")
+        return value
+
+    def save(self, **kwargs):
+        kwargs["user"] = self.context["request"].user
+        # abandoned uploads of the user are discarded along the way
+        UploadSession.objects.filter(
+            user=kwargs["user"],
+            created_at__lt=timezone.now() - settings.UPLOAD_SESSION_TTL,
+        ).delete()
+        return super().save(**kwargs)
 
 
 class CreateSongSerializer(ModelSerializer):
+    """Files are sent either in the request or as ids of complete chunked
+    uploads, see `UploadSession`."""
+
     genres = serializers.PrimaryKeyRelatedField(
         many=True, queryset=Genre.objects.all(), read_only=False
     )
+    audio_upload_id = serializers.UUIDField(write_only=True, required=False)
+    cover_upload_id = serializers.UUIDField(write_only=True, required=False)
 
     class Meta:
         model = Song
-        fields = ["audio_file", "cover_img", "title", "author", "genres", "lyrics"]
-        extra_kwargs = {"audio_file": {"required": True, "allow_null": False}}
+        fields = [
+            "id",
+            "audio_file",
+            "cover_img",
+            "title",
+            "author",
+            "genres",
+            "lyrics",
+            "processing_status",
+            "audio_upload_id",
+            "cover_upload_id",
+        ]
+        read_only_fields = ["processing_status"]
+        extra_kwargs = {"audio_file": {"required": False, "allow_null": False}}
+
+    def validate(self, attrs):
+        """Pass the files of chunked uploads through the file field validation."""
+        self._upload_sessions = []
+        try:
+            for file_field, upload_field in [
+                ("audio_file", "audio_upload_id"),
+                ("cover_img", "cover_upload_id"),
+            ]:
+                upload_id = attrs.pop(upload_field, None)
+                if upload_id is None:
+                    continue
+                session = UploadSession.objects.filter(
+                    pk=upload_id, user=self.context["request"].user
+                ).first()
+                if session is None or not session.is_complete:
+                    raise ValidationError({upload_field: "Upload is not complete."})
+                uploaded_file = session.open()
+                self._upload_sessions.append((session, uploaded_file))
+                try:
+                    attrs[file_field] = self.fields[file_field].run_validation(
+                        uploaded_file
+                    )
+                except ValidationError as error:
+                    raise ValidationError({file_field: error.detail})
+            if attrs.get("audio_file") is None:
+                raise ValidationError({"audio_file": "This field is required."})
+        except ValidationError:
+            self._close_upload_sessions()
+            raise
+        return attrs
+
+    def _close_upload_sessions(self, delete=False):
+        for session, uploaded_file in self._upload_sessions:
+            uploaded_file.close()
+            if delete:
+                session.delete()
 
     def create(self, validated_data):
+        """Store the raw files and leave derived media to a background job."""
         tmp_audio_file = validated_data.pop("audio_file")
         tmp_cover_img = validated_data.pop("cover_img", None)
         genres = validated_data.pop("genres")
-        instance = self.Meta.model.objects.create(**validated_data)
-        instance.genres.set(genres)
-        instance.audio_file.save(tmp_audio_file.name, tmp_audio_file.file, True)
+        audio_path = spool_upload(tmp_audio_file)
+        cover_path = None
         if tmp_cover_img is not None:
-            instance.cover_img.save(tmp_cover_img.name, tmp_cover_img.file, True)
-            make_thumbnail(instance)
-        instance.refresh_from_db()
+            cover_path = spool_upload(tmp_cover_img)
+        try:
+            # blob references are only taken if the song is created
+            with transaction.atomic():
+                if tmp_cover_img is not None:
+                    validated_data["cover_img"] = MediaBlob.objects.store(tmp_cover_img)
+                instance = self.Meta.model.objects.create(
+                    audio_file=MediaBlob.objects.store(tmp_audio_file),
+                    processing_status=Song.ProcessingStatus.PENDING,
+                    **read_audio_metadata(tmp_audio_file),
+                    **validated_data,
+                )
+                instance.genres.set(genres)
+                enqueue(
+                    "process_song_media", song_id=instance.id, cover_path=cover_path
+                )
+                enqueue(
+                    "transcode_song_audio", song_id=instance.id, audio_path=audio_path
+                )
+        except Exception:
+            remove_spooled(audio_path)
+            remove_spooled(cover_path)
+            raise
+        self._close_upload_sessions(delete=True)
         return instance
 
     def save(self, **kwargs):
@@ -263,50 +477,118 @@ class CreateSongSerializer(ModelSerializer):
         return super().save(**kwargs)
 
 
+class BulkDeleteSongsSerializer(Serializer):
+    song_ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=1000
+    )
+
+    def validate_song_ids(self, song_ids):
+        song_ids = set(song_ids)
+        owned = set(
+            Song.objects.filter(
+                pk__in=song_ids, added_by=self.context["user"]
+            ).values_list("pk", flat=True)
+        )
+        if owned != song_ids:
+            raise ValidationError(
+                f"Songs {sorted(song_ids - owned)} do not exist or are not yours."
+            )
+        return sorted(song_ids)
+
+    def save(self):
+        """Leave the deletion to a background job, see `tasks.delete_songs`."""
+        enqueue("delete_songs", song_ids=self.validated_data["song_ids"])
+        return self.validated_data["song_ids"]
+
+
 class EditSongSerializer(ModelSerializer):
     class Meta:
         model = Song
-        fields = ["cover_img", "title", "author", "genres", "lyrics"]
+        fields = [
+            "cover_img",
+            "title",
+            "author",
+            "genres",
+            "lyrics",
+            "processing_status",
+        ]
+        read_only_fields = ["processing_status"]
 
     def update(self, instance, validated_data):
-        super().update(instance, validated_data)
-        if "cover_img" in validated_data:
-            instance.thumbnail.delete()
-            if validated_data["cover_img"] is not None:
-                make_thumbnail(instance)
-        instance.refresh_from_db()
+        cover_path = None
+        if validated_data.get("cover_img") is not None:
+            cover_path = spool_upload(validated_data["cover_img"])
+        try:
+            # blob references are only taken if the song is updated
+            with transaction.atomic():
+                if cover_path is not None:
+                    cover_img = MediaBlob.objects.store(validated_data["cover_img"])
+                    validated_data["cover_img"] = cover_img
+                    if cover_img == instance.cover_img.name:
+                        # same contents as before, the song already holds a reference
+                        MediaBlob.objects.release(cover_img)
+                super().update(instance, validated_data)
+                if "cover_img" in validated_data:
+                    schedule_file_deletion(get_cover_derivative_names(instance))
+                    instance.thumbnail = None
+                    instance.cover_variants = {}
+                    if cover_path is not None:
+                        instance.processing_status = Song.ProcessingStatus.PENDING
+                    instance.save(
+                        update_fields=[
+                            "thumbnail",
+                            "cover_variants",
+                            "processing_status",
+                        ]
+                    )
+                    if cover_path is not None:
+                        enqueue(
+                            "process_song_media",
+                            song_id=instance.id,
+                            cover_path=cover_path,
+                        )
+        except Exception:
+            remove_spooled(cover_path)
+            raise
         return instance
 
 
-class GetSongInPlaylistSerializer(ModelSerializer):
+class GetSongInPlaylistSerializer(SongMediaSerializer):
+    """Expects songs annotated with `order_num`, see `Playlist.get_ordered_songs`."""
+
     can_edit = serializers.SerializerMethodField()
+    cover_srcset = serializers.SerializerMethodField()
+    hls = serializers.SerializerMethodField()
     added_by = serializers.StringRelatedField()
-    order_num = serializers.SerializerMethodField()
+    order_num = serializers.IntegerField(read_only=True)
     genres = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
 
     class Meta:
         model = Song
+        list_serializer_class = SongMediaListSerializer
         fields = [
             "id",
             "order_num",
             "added_by",
             "audio_file",
             "thumbnail",
+            "cover_srcset",
+            "hls",
             "title",
             "author",
             "genres",
+            "duration",
             "can_edit",
         ]
 
-    def get_can_edit(self, obj):
-        return self.context["user"] == obj.added_by
+    def get_cover_srcset(self, obj):
+        return get_cover_srcset(obj, self.context.get("request"))
 
-    def get_order_num(self, obj):
-        curr_song = self.instance
-        curr_playlist = self.context["playlist"]
-        return SongPlaylist.objects.get(
-            song=curr_song, playlist=curr_playlist
-        ).order_num
+    def get_hls(self, obj):
+        return get_hls(obj, self.context.get("request"))
+
+    def get_can_edit(self, obj):
+        return self.context["user"].pk == obj.added_by_id
 
 
 # Genre model serializers
@@ -318,6 +600,16 @@ class GetGenreSerializer(ModelSerializer):
         fields = ["id", "name"]
 
 
+# Search serializers
+
+
+class SuggestQuerySerializer(Serializer):
+    q = serializers.CharField(required=True, max_length=100)
+    limit = serializers.IntegerField(
+        required=False, default=10, min_value=1, max_value=25
+    )
+
+
 # Playlist model serializers
 class GetFlatPlaylistSerializer(ModelSerializer):
     added_by = serializers.StringRelatedField()
@@ -328,50 +620,64 @@ class GetFlatPlaylistSerializer(ModelSerializer):
 
 
 class GetDeepPlaylistSerializer(ModelSerializer):
+    """Playlist metadata plus the first page of its songs.
+
+    Further pages are served by `playlists/<pk>/tracks/`, `songs_next` links
+    to the second one. Expects `user` and `request` in the context.
+    """
+
     added_by = serializers.StringRelatedField()
-    songs = serializers.SerializerMethodField()
     can_edit = serializers.SerializerMethodField()
 
     class Meta:
         model = Playlist
-        fields = ["id", "name", "added_by", "songs", "can_edit"]
+        fields = ["id", "name", "added_by", "can_edit"]
 
     def get_can_edit(self, obj):
-        return self.context["user"] == obj.added_by
-
-    def get_songs(self, obj):
-        data = [
-            GetSongInPlaylistSerializer(
-                song,
-                context={"playlist": self.instance, "user": self.context["user"]},
-            ).data
-            for song in self.instance.songs.all()
-        ]
-        return sorted(
-            data,
-            key=lambda song: song["order_num"],
+        return self.context["user"].pk == obj.added_by_id
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data["duration"] = instance.get_duration()
+        request = self.context["request"]
+        paginator = PlaylistTracksPagination()
+        page = paginator.paginate_queryset(instance.get_ordered_songs(), request)
+        data["songs"] = GetSongInPlaylistSerializer(
+            page,
+            many=True,
+            context={"user": self.context["user"], "request": request},
+        ).data
+        paginator.base_url = request.build_absolute_uri(
+            reverse("playlist-tracks", kwargs={"pk": instance.pk})
         )
+        data["songs_next"] = paginator.get_next_link()
+        return data
 
 
 class CreateUpdatePlaylistSerializer(Serializer):
     name = serializers.CharField(required=True, max_length=100)
-    song_ids_ordered = serializers.PrimaryKeyRelatedField(
-        required=True, read_only=False, queryset=Song.objects.all(), many=True
+    song_ids_ordered = serializers.ListField(
+        child=serializers.IntegerField(), required=True
     )
 
+    def validate_song_ids_ordered(self, song_ids):
+        # one query for the whole list, playlists may hold thousands of songs
+        if not song_ids:
+            return song_ids
+        found = set(Song.objects.filter(pk__in=song_ids).values_list("pk", flat=True))
+        missing = set(song_ids) - found
+        if missing:
+            raise ValidationError(f"Songs {sorted(missing)} do not exist.")
+        return song_ids
+
     def validate(self, raw_data):
         if "playlist" in self.context:
             self.instance = self.context["playlist"]
         else:
             self.instance = None
-        max_playlist_length = 50
         if "song_ids_ordered" in raw_data:
             if raw_data["song_ids_ordered"] is None:
                 raw_data["song_ids_ordered"] = []
-            if len(raw_data["song_ids_ordered"]) > max_playlist_length:
-                raise ValidationError(
-                    f"Too much entries passed! Maximum amount is {max_playlist_length}."
-                )
             if len(set(raw_data["song_ids_ordered"])) != len(
                 raw_data["song_ids_ordered"]
             ):
@@ -381,28 +687,169 @@ class CreateUpdatePlaylistSerializer(Serializer):
         return raw_data
 
     def save(self):
-        if self.instance is not None:
-            if "name" in self.validated_data:
-                self.instance.name = self.validated_data["name"].strip()
-                self.instance.save(update_fields=["name"])
-        else:
-            self.instance = Playlist.objects.create(
-                added_by=self.context["user"],
-                name=self.validated_data["name"].strip(),
-            )
-        if "song_ids_ordered" in self.validated_data:
-            song_order_list = list(
-                zip(
-                    self.validated_data["song_ids_ordered"],
-                    [_ for _ in range(len(self.validated_data["song_ids_ordered"]))],
-                )
-            )
-            SongPlaylist.objects.filter(playlist=self.instance).delete()
-            for entry in song_order_list:
-                SongPlaylist.objects.create(
-                    song=entry[0],
-                    playlist=self.instance,
-                    order_num=entry[1],
+        with transaction.atomic():
+            if self.instance is not None:
+                if "name" in self.validated_data:
+                    self.instance.name = self.validated_data["name"].strip()
+                    self.instance.save(update_fields=["name"])
+            else:
+                self.instance = Playlist.objects.create(
+                    added_by=self.context["user"],
+                    name=self.validated_data["name"].strip(),
                 )
+            if "song_ids_ordered" in self.validated_data:
+                self._rewrite_songs(self.validated_data["song_ids_ordered"])
         self.instance.refresh_from_db()
         return self.instance
+
+    def _rewrite_songs(self, song_ids_ordered):
+        """Diff the stored ordering against the new one and write only changes."""
+        existing = {
+            entry.song_id: entry
+            for entry in SongPlaylist.objects.select_for_update().filter(
+                playlist=self.instance
+            )
+        }
+        new_order = {
+            song_id: (i + 1) * SongPlaylist.ORDER_GAP
+            for i, song_id in enumerate(song_ids_ordered)
+        }
+
+        removed_ids = existing.keys() - new_order.keys()
+        if removed_ids:
+            SongPlaylist.objects.filter(
+                pk__in=[existing[song_id].pk for song_id in removed_ids]
+            ).delete()
+
+        changed = []
+        for song_id, entry in existing.items():
+            if song_id in new_order and entry.order_num != new_order[song_id]:
+                entry.order_num = new_order[song_id]
+                changed.append(entry)
+        if changed:
+            SongPlaylist.objects.bulk_update(changed, ["order_num"])
+
+        added = [
+            SongPlaylist(song_id=song_id, playlist=self.instance, order_num=order_num)
+            for song_id, order_num in new_order.items()
+            if song_id not in existing
+        ]
+        if added:
+            SongPlaylist.objects.bulk_create(added)
+            # bulk_create sends no signals
+            schedule_playlist_search_update([self.instance.pk])
+
+
+class PlaylistOperationSerializer(Serializer):
+    """A single incremental change of a playlist.
+
+    `position` is the index the song should end up at, counted in the
+    playlist without the song itself; positions past the end append.
+    """
+
+    OPS_WITH_POSITION = ("insert", "move")
+
+    op = serializers.ChoiceField(choices=["insert", "move", "remove", "append"])
+    song_id = serializers.PrimaryKeyRelatedField(queryset=Song.objects.all())
+    position = serializers.IntegerField(required=False, min_value=0)
+
+    def validate(self, raw_data):
+        if raw_data["op"] in self.OPS_WITH_POSITION and "position" not in raw_data:
+            raise ValidationError(
+                {"position": f"Position is required for '{raw_data['op']}'."}
+            )
+        return raw_data
+
+
+class PlaylistOperationsSerializer(Serializer):
+    operations = PlaylistOperationSerializer(many=True, allow_empty=False)
+
+    def save(self):
+        playlist = self.context["playlist"]
+        with transaction.atomic():
+            # serialize concurrent edits of the same playlist
+            Playlist.objects.select_for_update().filter(pk=playlist.pk).first()
+            for operation in self.validated_data["operations"]:
+                getattr(self, f"_apply_{operation['op']}")(playlist, operation)
+        playlist.refresh_from_db()
+        return playlist
+
+    def _apply_append(self, playlist, operation):
+        self._check_not_in_playlist(playlist, operation["song_id"])
+        last_order_num = SongPlaylist.objects.filter(playlist=playlist).aggregate(
+            last=Max("order_num")
+        )["last"]
+        SongPlaylist.objects.create(
+            song=operation["song_id"],
+            playlist=playlist,
+            order_num=(last_order_num or 0) + SongPlaylist.ORDER_GAP,
+        )
+
+    def _apply_insert(self, playlist, operation):
+        self._check_not_in_playlist(playlist, operation["song_id"])
+        SongPlaylist.objects.create(
+            song=operation["song_id"],
+            playlist=playlist,
+            order_num=self._order_num_at(playlist, operation["position"]),
+        )
+
+    def _apply_move(self, playlist, operation):
+        song = operation["song_id"]
+        entry = self._get_entry(playlist, song)
+        entry.order_num = self._order_num_at(
+            playlist, operation["position"], exclude_song=song
+        )
+        entry.save(update_fields=["order_num"])
+
+    def _apply_remove(self, playlist, operation):
+        self._get_entry(playlist, operation["song_id"]).delete()
+
+    def _get_entry(self, playlist, song):
+        try:
+            return SongPlaylist.objects.get(playlist=playlist, song=song)
+        except SongPlaylist.DoesNotExist:
+            raise ValidationError(
+                {"song_id": f"Song {song.id} is not in the playlist."}
+            )
+
+    def _check_not_in_playlist(self, playlist, song):
+        if SongPlaylist.objects.filter(playlist=playlist, song=song).exists():
+            raise ValidationError(
+                {"song_id": f"Song {song.id} is already in the playlist."}
+            )
+
+    def _order_num_at(self, playlist, position, exclude_song=None, renumbered=False):
+        """Return an order_num placing a song at `position` without touching
+        other rows, unless the neighbours have no free value left between them."""
+        entries = SongPlaylist.objects.filter(playlist=playlist)
+        if exclude_song is not None:
+            entries = entries.exclude(song=exclude_song)
+        order_nums = entries.order_by("order_num").values_list("order_num", flat=True)
+        if position == 0:
+            before, after = None, order_nums.first()
+        else:
+            neighbours = list(order_nums[position - 1 : position + 1])
+            if not neighbours:
+                # past the end of the playlist
+                before, after = order_nums.last(), None
+            else:
+                before, after = (neighbours + [None])[:2]
+
+        if before is None and after is None:
+            return SongPlaylist.ORDER_GAP
+        if after is None:
+            return before + SongPlaylist.ORDER_GAP
+        if before is None:
+            return after - SongPlaylist.ORDER_GAP
+        if after - before > 1:
+            return (before + after) // 2
+        if renumbered:
+            raise RuntimeError("No free order_num left after renumbering.")
+        self._renumber(entries)
+        return self._order_num_at(playlist, position, exclude_song, renumbered=True)
+
+    def _renumber(self, entries):
+        entries = list(entries.order_by("order_num"))
+        for i, entry in enumerate(entries):
+            entry.order_num = (i + 1) * SongPlaylist.ORDER_GAP
+        SongPlaylist.objects.bulk_update(entries, ["order_num"])
@@ -0,0 +1,117 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.files.storage import default_storage as storage
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """Return the (start, end) byte positions, both inclusive, requested by a
+    `Range` header, or None when the whole file should be sent.
+
+    Only single ranges are honoured; anything else is ignored as allowed by
+    RFC 9110 and answered with the full file.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # suffix range, the last `end` bytes
+        if int(end) == 0:
+            raise RangeNotSatisfiable
+        return max(size - int(end), 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable
+    return start, end
+
+
+def iter_file_range(media_file, start, length, chunk_size):
+    """Yield `length` bytes of `media_file` from `start` in bounded chunks,
+    closing the file when done."""
+    try:
+        media_file.seek(start)
+        while length > 0:
+            chunk = media_file.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        media_file.close()
+
+
+def serve_media(request, name):
+    """Serve a stored media file with support for single byte ranges.
+
+    When the files live on the local filesystem and a front web server is
+    configured (`MEDIA_OFFLOAD_HEADER`), the transfer is handed over to it with
+    an `X-Accel-Redirect` or `X-Sendfile` header, which also takes care of the
+    ranges. Otherwise the requested bytes are streamed in chunks of
+    `MEDIA_STREAM_CHUNK_SIZE`.
+
+    Remote storages (Cloudinary) serve ranges themselves, while opening a file
+    through them downloads it whole, so clients are redirected to the storage
+    URL instead.
+    """
+    if not name or name.endswith("/"):
+        raise Http404
+    if not isinstance(storage, FileSystemStorage):
+        return HttpResponseRedirect(storage.url(name))
+    if not os.path.isfile(storage.path(name)):
+        # the name of a directory, MEDIA_ROOT itself for an empty field
+        raise Http404
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    offload_header = settings.MEDIA_OFFLOAD_HEADER
+    if offload_header:
+        response = HttpResponse(content_type=content_type)
+        if offload_header == "X-Accel-Redirect":
+            response[offload_header] = settings.MEDIA_OFFLOAD_PREFIX + name
+        else:
+            response[offload_header] = storage.path(name)
+        return response
+
+    size = storage.size(name)
+    try:
+        byte_range = parse_range(request.headers.get("Range"), size)
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+    start, end = byte_range or (0, size - 1)
+
+    response = StreamingHttpResponse(
+        iter_file_range(
+            storage.open(name, "rb"),
+            start,
+            end - start + 1,
+            settings.MEDIA_STREAM_CHUNK_SIZE,
+        ),
+        status=206 if byte_range else 200,
+        content_type=content_type,
+    )
+    response["Content-Length"] = str(end - start + 1)
+    response["Accept-Ranges"] = "bytes"
+    if byte_range:
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return response
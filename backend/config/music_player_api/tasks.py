@@ -0,0 +1,163 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from music_player_api.jobs import job
+from music_player_api.models import (
+    DeletedFile,
+    Playlist,
+    Song,
+    SongWaveform,
+    User,
+    queue_file_sweep,
+    referenced_media_names,
+    schedule_file_deletion,
+)
+from music_player_api.transcoding import (
+    compute_waveform_peaks,
+    local_audio_file,
+    make_audio_renditions,
+)
+from music_player_api.utils import (
+    THUMBNAIL_SIZE,
+    delete_stored_files,
+    get_cover_derivative_names,
+    make_cover_derivatives,
+    remove_spooled,
+)
+
+
+def mark_song_media_failed(song_id, cover_path=None):
+    remove_spooled(cover_path)
+    Song.objects.filter(pk=song_id).update(
+        processing_status=Song.ProcessingStatus.FAILED
+    )
+
+
+@job("process_song_media", on_failure=mark_song_media_failed)
+def process_song_media(song_id, cover_path=None):
+    """Produce derived media of a freshly uploaded or edited song.
+
+    `cover_path` is the spooled copy of the cover upload; it is removed
+    afterwards and retries fall back to reading the cover from the storage.
+    Derivatives of an earlier run are kept until the new ones are saved.
+    The song stays processing while failed runs are retried and is marked
+    failed after the last attempt.
+    """
+    song = Song.objects.filter(pk=song_id).first()
+    if song is None:
+        # deleted in the meantime
+        remove_spooled(cover_path)
+        return
+    Song.objects.filter(pk=song_id).update(
+        processing_status=Song.ProcessingStatus.PROCESSING
+    )
+    try:
+        cover_variants = (
+            make_cover_derivatives(song, cover_path) if song.cover_img else {}
+        )
+    finally:
+        remove_spooled(cover_path)
+    thumbnail = cover_variants.get(str(THUMBNAIL_SIZE), {}).get("jpeg")
+    with transaction.atomic():
+        Song.objects.filter(pk=song_id).update(
+            cover_variants=cover_variants,
+            thumbnail=thumbnail,
+            processing_status=Song.ProcessingStatus.READY,
+        )
+        schedule_file_deletion(
+            get_cover_derivative_names(song)
+            - {name for formats in cover_variants.values() for name in formats.values()}
+        )
+
+
+@job("transcode_song_audio")
+def transcode_song_audio(song_id, audio_path=None):
+    """Transcode the song audio into HLS renditions of several bitrates and
+    compute its waveform.
+
+    `audio_path` is the spooled copy of the audio upload; it is removed
+    afterwards and retries fall back to reading the audio from the storage.
+    Until the renditions are ready clients play the original file, or the
+    renditions of an earlier run, which are kept until the new ones are saved.
+    """
+    try:
+        song = Song.objects.filter(pk=song_id).first()
+        if song is None or not song.audio_file:
+            return
+        with local_audio_file(song, audio_path) as source_path:
+            audio_renditions = make_audio_renditions(song, source_path)
+            peaks = compute_waveform_peaks(source_path, settings.WAVEFORM_BUCKETS)
+    finally:
+        remove_spooled(audio_path)
+    with transaction.atomic():
+        Song.objects.filter(pk=song_id).update(audio_renditions=audio_renditions)
+        schedule_file_deletion(
+            set(song.audio_renditions.get("files", [])) - set(audio_renditions["files"])
+        )
+    SongWaveform.objects.update_or_create(song_id=song_id, defaults={"peaks": peaks})
+
+
+@job("sweep_deleted_files")
+def sweep_deleted_files():
+    """Delete the stored files queued by `schedule_file_deletion`.
+
+    Works in batches of `MEDIA_SWEEP_BATCH_SIZE`, each in a transaction
+    holding its rows, so that concurrent sweeps skip each other and rows are
+    only removed once their files are gone; a failed batch stays queued for
+    the retry. Files taken into use again in the meantime are kept.
+    """
+    while True:
+        with transaction.atomic():
+            batch = list(
+                DeletedFile.objects.select_for_update(skip_locked=True)
+                .filter(delete_after__lte=timezone.now())
+                .order_by("delete_after")[: settings.MEDIA_SWEEP_BATCH_SIZE]
+            )
+            if not batch:
+                break
+            names = {deleted.name for deleted in batch}
+            delete_stored_files(names - referenced_media_names(names))
+            DeletedFile.objects.filter(
+                pk__in=[deleted.pk for deleted in batch]
+            ).delete()
+    # files queued with a grace period; due ones are left to concurrent sweeps
+    next_due = (
+        DeletedFile.objects.filter(delete_after__gt=timezone.now())
+        .order_by("delete_after")
+        .first()
+    )
+    if next_due is not None:
+        queue_file_sweep(next_due.delete_after)
+
+
+def delete_in_batches(queryset):
+    """Delete the rows of `queryset` `DELETION_BATCH_SIZE` at a time, each
+    batch in its own transaction, so that a retried job resumes where it
+    stopped. Stored files go through `schedule_file_deletion`."""
+    while True:
+        with transaction.atomic():
+            ids = list(
+                queryset.values_list("pk", flat=True)[: settings.DELETION_BATCH_SIZE]
+            )
+            if not ids:
+                return
+            queryset.model.objects.filter(pk__in=ids).delete()
+
+
+@job("delete_songs")
+def delete_songs(song_ids):
+    delete_in_batches(Song.objects.filter(pk__in=song_ids).order_by("pk"))
+
+
+@job("delete_user")
+def delete_user(user_id):
+    """Delete an account deactivated by `UserInfoViewSet.delete_current`
+    together with its songs and playlists."""
+    user = User.objects.filter(pk=user_id, is_active=False).first()
+    if user is None:
+        # deleted already, or reactivated in the meantime
+        return
+    delete_in_batches(Song.objects.filter(added_by_id=user_id).order_by("pk"))
+    delete_in_batches(Playlist.objects.filter(added_by_id=user_id).order_by("pk"))
+    user.delete()
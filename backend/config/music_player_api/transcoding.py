@@ -0,0 +1,166 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage as storage
+
+from music_player_api.utils import upload_rendition_to
+
+# AAC-LC, as declared in the master playlist
+AUDIO_CODEC = "mp4a.40.2"
+
+
+def encode_rendition(source_path, output_dir, bitrate):
+    """Encode the audio of `source_path` to AAC at `bitrate` kbps, cut into
+    HLS segments in `output_dir`. Returns the rendition playlist file name."""
+    playlist = f"{bitrate}k.m3u8"
+    subprocess.run(
+        [
+            settings.FFMPEG_BINARY,
+            "-nostdin",
+            "-v",
+            "error",
+            "-y",
+            "-i",
+            source_path,
+            "-vn",
+            "-map",
+            "0:a:0",
+            "-c:a",
+            "aac",
+            "-b:a",
+            f"{bitrate}k",
+            "-ac",
+            "2",
+            "-f",
+            "hls",
+            "-hls_time",
+            str(settings.HLS_SEGMENT_SECONDS),
+            "-hls_playlist_type",
+            "vod",
+            "-hls_segment_filename",
+            os.path.join(output_dir, f"{bitrate}k_%04d.ts"),
+            os.path.join(output_dir, playlist),
+        ],
+        check=True,
+        capture_output=True,
+        timeout=settings.TRANSCODE_TIMEOUT,
+    )
+    return playlist
+
+
+def encode_renditions(source_path, output_dir):
+    """Encode every bitrate of `AUDIO_RENDITION_BITRATES`, running at most
+    `TRANSCODE_MAX_PROCESSES` ffmpeg processes at once, and write the master
+    playlist listing them. Returns {"<bitrate>": rendition playlist name}."""
+    bitrates = sorted(settings.AUDIO_RENDITION_BITRATES)
+    with ThreadPoolExecutor(max_workers=settings.TRANSCODE_MAX_PROCESSES) as pool:
+        playlists = pool.map(
+            lambda bitrate: encode_rendition(source_path, output_dir, bitrate),
+            bitrates,
+        )
+        renditions = dict(zip(map(str, bitrates), playlists))
+
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+    for bitrate, playlist in renditions.items():
+        lines.append(
+            f"#EXT-X-STREAM-INF:BANDWIDTH={int(bitrate) * 1000},"
+            + f'CODECS="{AUDIO_CODEC}"'
+        )
+        lines.append(playlist)
+    with open(os.path.join(output_dir, "master.m3u8"), "w") as master:
+        master.write("\n".join(lines) + "\n")
+    return renditions
+
+
+@contextmanager
+def local_audio_file(song, source_path=None):
+    """Path of a local copy of the song audio: `source_path` (a spooled copy
+    of the upload) when it exists, else a temporary download from the storage.
+    """
+    if source_path is not None and os.path.exists(source_path):
+        yield source_path
+        return
+    suffix = os.path.splitext(song.audio_file.name)[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix) as local_copy:
+        with storage.open(song.audio_file.name, "rb") as stored:
+            shutil.copyfileobj(stored, local_copy)
+        local_copy.flush()
+        yield local_copy.name
+
+
+def make_audio_renditions(song, source_path):
+    """Transcode the audio at `source_path` into HLS renditions of the song
+    and store them.
+
+    Playlists refer to segments and renditions by relative names. Storages
+    may rename saved files (Cloudinary adds a random suffix), so segments are
+    stored first and the playlists rewritten with the stored names.
+    Returns {"master": name, "renditions": {"<bitrate>": name}, "files": [...]}
+    with the stored file names.
+    """
+    with tempfile.TemporaryDirectory() as output_dir:
+        renditions = encode_renditions(source_path, output_dir)
+        stored_names = {}
+        for filename in sorted(os.listdir(output_dir)):
+            if filename.endswith(".ts"):
+                with open(os.path.join(output_dir, filename), "rb") as segment:
+                    stored_names[filename] = storage.save(
+                        upload_rendition_to(song, filename), segment
+                    )
+        for playlist in [*renditions.values(), "master.m3u8"]:
+            with open(os.path.join(output_dir, playlist)) as playlist_file:
+                lines = playlist_file.read().splitlines()
+            lines = [
+                os.path.basename(stored_names[line]) if line in stored_names else line
+                for line in lines
+            ]
+            stored_names[playlist] = storage.save(
+                upload_rendition_to(song, playlist),
+                ContentFile("\n".join(lines) + "\n"),
+            )
+    return {
+        "master": stored_names["master.m3u8"],
+        "renditions": {
+            bitrate: stored_names[playlist] for bitrate, playlist in renditions.items()
+        },
+        "files": list(stored_names.values()),
+    }
+
+
+def compute_waveform_peaks(source_path, buckets):
+    """Peak amplitude of each of `buckets` equal slices of the audio, scaled
+    to 0-255. Returned as bytes, one per bucket."""
+    decoded = subprocess.run(
+        [
+            settings.FFMPEG_BINARY,
+            "-nostdin",
+            "-v",
+            "error",
+            "-i",
+            source_path,
+            "-vn",
+            "-ac",
+            "1",
+            "-ar",
+            str(settings.WAVEFORM_SAMPLE_RATE),
+            "-f",
+            "s16le",
+            "-",
+        ],
+        check=True,
+        capture_output=True,
+        timeout=settings.TRANSCODE_TIMEOUT,
+    ).stdout
+    samples = np.abs(np.frombuffer(decoded, dtype="<i2").astype(np.int32))
+    if samples.size < buckets:
+        samples = np.pad(samples, (0, buckets - samples.size))
+    starts = np.linspace(0, samples.size, buckets, endpoint=False).astype(np.int64)
+    peaks = np.maximum.reduceat(samples, starts)
+    return (np.minimum(peaks, 32767) * 255 // 32767).astype(np.uint8).tobytes()
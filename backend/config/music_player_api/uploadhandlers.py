@@ -0,0 +1,63 @@
+import os
+
+import magic
+from django.core.files.uploadhandler import FileUploadHandler
+from djangorestframework_camel_case.util import camel_to_underscore
+
+from music_player_api.utils import (
+    AUDIO_EXTENSIONS,
+    AUDIO_MIME_TYPES,
+    MAX_UPLOAD_SIZE,
+    UploadRejected,
+)
+
+AUDIO_FIELDS = {"audio_file"}
+IMAGE_FIELDS = {"avatar", "cover_img"}
+
+
+class ValidatingUploadHandler(FileUploadHandler):
+    """Reject uploaded files while the request body is still being received.
+
+    Installed ahead of the default handlers by the views taking media uploads,
+    see `ValidatedUploadsMixin`. It checks the MIME type of known media fields
+    on their first chunk and the size limit as the bytes arrive, and aborts
+    parsing of the rest of the body with `UploadRejected` on failure. The data
+    itself is passed on to the next handlers. The model field validators
+    still run on the complete files.
+    """
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.field = camel_to_underscore(field_name)
+        self.received = 0
+        if (
+            self.field in AUDIO_FIELDS
+            and os.path.splitext(file_name)[1].lower() not in AUDIO_EXTENSIONS
+        ):
+            self.reject("Unacceptable file extension.")
+
+    def receive_data_chunk(self, raw_data, start):
+        if start == 0:
+            mime_type = magic.from_buffer(raw_data[:1024], mime=True)
+            if self.field in AUDIO_FIELDS and mime_type not in AUDIO_MIME_TYPES:
+                self.reject("Unsupported file type.")
+            if self.field in IMAGE_FIELDS and not mime_type.startswith("image/"):
+                self.reject("Upload a valid image.")
+        self.received += len(raw_data)
+        if self.received > MAX_UPLOAD_SIZE:
+            self.reject("File is too large. Size should not exceed 10 MB.")
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+    def reject(self, message):
+        raise UploadRejected(self.field, message)
+
+
+class ValidatedUploadsMixin:
+    """Check the files uploaded to the view with `ValidatingUploadHandler`."""
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers.insert(0, ValidatingUploadHandler(request))
+        return super().initialize_request(request, *args, **kwargs)
@@ -11,8 +11,11 @@ from music_player_api.views import (
     SearchMyPlaylistsAPIView,
     SearchMySongsAPIView,
     SongViewSet,
+    SuggestAPIView,
+    UploadSessionViewSet,
     UserInfoViewSet,
     change_my_password,
+    signed_media,
 )
 
 urlpatterns = [
@@ -30,6 +33,12 @@ urlpatterns = [
         ),
         name="reset-password",
     ),
+    # Media Views
+    path(
+        "media/<int:expires>/<str:signature>/<path:name>",
+        signed_media,
+        name="signed-media",
+    ),
     # User Settings Views
     path(
         "users/settings/",
@@ -53,12 +62,30 @@ urlpatterns = [
     path(
         "my-playlists/", SearchMyPlaylistsAPIView.as_view(), name="search_my_playlists"
     ),
+    path("search/suggest/", SuggestAPIView.as_view(), name="search_suggest"),
     # Genre Views
     path(
         "get-available-genres/",
         GetAvailableGenres.as_view(),
         name="get_available_genres",
     ),
+    # Chunked upload Views
+    path(
+        "uploads/",
+        UploadSessionViewSet.as_view({"post": "create"}),
+        name="create-upload",
+    ),
+    path(
+        "uploads/<uuid:pk>/",
+        UploadSessionViewSet.as_view(
+            {
+                "get": "retrieve",
+                "patch": "append_chunk",
+                "delete": "destroy",
+            }
+        ),
+        name="RUD-upload",
+    ),
     # Song Views
     path(
         "songs/<int:pk>/",
@@ -71,7 +98,22 @@ urlpatterns = [
         ),
         name="RUD-song",
     ),
+    path(
+        "songs/<int:pk>/stream/",
+        SongViewSet.as_view({"get": "stream"}),
+        name="song-stream",
+    ),
+    path(
+        "songs/<int:pk>/waveform/",
+        SongViewSet.as_view({"get": "waveform"}),
+        name="song-waveform",
+    ),
     path("songs/", SongViewSet.as_view({"post": "create"}), name="create-song"),
+    path(
+        "songs/bulk-delete/",
+        SongViewSet.as_view({"post": "bulk_delete"}),
+        name="bulk-delete-songs",
+    ),
     # Playlist Views
     path(
         "playlists/<int:pk>/",
@@ -84,6 +126,16 @@ urlpatterns = [
         ),
         name="RUD-playlist",
     ),
+    path(
+        "playlists/<int:pk>/tracks/",
+        PlaylistViewSet.as_view({"get": "list_tracks"}),
+        name="playlist-tracks",
+    ),
+    path(
+        "playlists/<int:pk>/operations/",
+        PlaylistViewSet.as_view({"post": "apply_operations"}),
+        name="playlist-operations",
+    ),
     path(
         "playlists/",
         PlaylistViewSet.as_view({"post": "create"}),
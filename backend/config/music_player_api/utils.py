@@ -1,15 +1,22 @@
+import hashlib
 import os
 import random
 import string
+import uuid
 from datetime import timedelta
 from io import BytesIO
 
+import cloudinary.api
 import magic
+import mutagen
+from cloudinary_storage.helpers import get_resources_by_path
+from cloudinary_storage.storage import MediaCloudinaryStorage
 from django.conf import settings
 from django.core.cache import cache
+from django.core.exceptions import SuspiciousOperation
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage as storage
-from PIL import Image
+from PIL import Image, ImageOps
 from rest_framework.serializers import ValidationError
 from rest_framework.views import exception_handler
 
@@ -60,6 +67,44 @@ class SessionTokenManager:
         return True
 
 
+# Cached responses
+
+
+class GenreCatalogCache:
+    """Genre list payload cached under a version bumped on every Genre change."""
+
+    __version_key = "genres__version"
+    __payload_ttl = timedelta(days=1)
+
+    @classmethod
+    def get_version(cls) -> str:
+        version = cache.get(cls.__version_key, None)
+        if version is not None:
+            return version
+        cache.add(cls.__version_key, uuid.uuid4().hex, timeout=None)
+        return cache.get(cls.__version_key)
+
+    @classmethod
+    def bump_version(cls):
+        cache.set(cls.__version_key, uuid.uuid4().hex, timeout=None)
+
+    @classmethod
+    def get_etag(cls, version: str) -> str:
+        return f'"genres-{version}"'
+
+    @classmethod
+    def get_payload(cls, version: str):
+        return cache.get(f"genres__payload__{version}", None)
+
+    @classmethod
+    def set_payload(cls, version: str, payload):
+        cache.set(
+            f"genres__payload__{version}",
+            payload,
+            timeout=cls.__payload_ttl.total_seconds(),
+        )
+
+
 # Custom Django Exception handler
 
 
@@ -79,6 +124,8 @@ def custom_exception_handler(exc, context):
                 to_return.extend(get_list_from_errors(err))
         return to_return
 
+    if isinstance(exc, UploadRejected):
+        exc = ValidationError({exc.field: [exc.message]})
     response = exception_handler(exc, context)
     if response is not None:
         newdata["errors"].extend(get_list_from_errors(response.data))
@@ -114,6 +161,21 @@ def upload_thumbnail_to(instance, filename):
     )
 
 
+def upload_cover_variant_to(instance, size, extension):
+    """Instance is of type Song."""
+    return f"{settings.UPLOAD_ROOT}/songs/{instance.id}/cover_{size}.{extension}"
+
+
+def upload_blob_to(digest, extension):
+    """Content addressed name of a stored file, see `MediaBlob`."""
+    return f"{settings.UPLOAD_ROOT}/blobs/{digest[:2]}/{digest}{extension}"
+
+
+def upload_rendition_to(instance, filename):
+    """Instance is of type Song."""
+    return f"{settings.UPLOAD_ROOT}/songs/{instance.id}/hls/{filename}"
+
+
 def upload_audio_to(instance, filename):
     """Instance is of type Song."""
     return (
@@ -125,54 +187,248 @@ def upload_audio_to(instance, filename):
 # MIME type FileField validators
 
 
+AUDIO_MIME_TYPES = [
+    "audio/aac",
+    "audio/midi",
+    "audio/x-midi",
+    "audio/mpeg",
+    "audio/ogg",
+    "audio/opus",
+    "audio/wav",
+    "audio/x-wav",
+    "audio/webm",
+]
+AUDIO_EXTENSIONS = [
+    ".aac",
+    ".mid",
+    ".midi",
+    ".mp3",
+    ".oga",
+    ".opus",
+    ".wav",
+    ".weba",
+]
+
+
 def validate_is_music(file):
-    valid_mime_types = [
-        "audio/aac",
-        "audio/midi",
-        "audio/x-midi",
-        "audio/mpeg",
-        "audio/ogg",
-        "audio/opus",
-        "audio/wav",
-        "audio/webm",
-    ]
+    file.seek(0)
     file_mime_type = magic.from_buffer(file.read(1024), mime=True)
-    if file_mime_type not in valid_mime_types:
+    file.seek(0)
+    if file_mime_type not in AUDIO_MIME_TYPES:
         raise ValidationError("Unsupported file type.")
-    valid_file_extensions = [
-        ".aac",
-        ".mid",
-        ".midi",
-        ".mp3",
-        ".oga",
-        ".opus",
-        ".wav",
-        ".weba",
-    ]
     ext = os.path.splitext(file.name)[1]
-    if ext.lower() not in valid_file_extensions:
+    if ext.lower() not in AUDIO_EXTENSIONS:
         raise ValidationError("Unacceptable file extension.")
 
 
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+
+
+class UploadRejected(SuspiciousOperation):
+    """An uploaded file failed validation while the request body was being
+    parsed. A 400 response in any view, with the field error in API views."""
+
+    def __init__(self, field, message):
+        super().__init__(message)
+        self.field = field
+        self.message = message
+
+
 def validate_file_size(file):
-    limit = 10 * 1024 * 1024
-    if file.size > limit:
+    if file.size > MAX_UPLOAD_SIZE:
         raise ValidationError("File is too large. Size should not exceed 10 MB.")
 
 
-# Thumbnail helper function
+# Audio metadata
+
+
+def read_audio_metadata(file):
+    """Technical metadata and embedded tags of an audio file, as `Song` field
+    values. Returns an empty dict for streams mutagen cannot parse.
+
+    Only the headers (and the tags) are read; the file is rewound afterwards.
+    """
+    file.seek(0)
+    try:
+        audio = mutagen.File(file, easy=True)
+    except mutagen.MutagenError:
+        audio = None
+    finally:
+        file.seek(0)
+    if audio is None:
+        return {}
+    info = audio.info
+    return {
+        "duration": getattr(info, "length", None),
+        "bitrate": getattr(info, "bitrate", None) or None,
+        "sample_rate": getattr(info, "sample_rate", None),
+        "codec": getattr(info, "codec", None)
+        or type(audio).__name__.lower().removeprefix("easy"),
+        "tags": {
+            key: [str(value) for value in values]
+            for key, values in (audio.tags or {}).items()
+        },
+    }
+
+
+def hash_file(file):
+    """Hex SHA-256 of the contents of a Django `File`, read in chunks."""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+# Local spool of uploads
+
+
+def spool_upload(upload):
+    """Copy an upload to the local spool directory and return the copy's path.
+
+    Lets background jobs process a file that was just uploaded without
+    fetching it back from the remote storage. The spool directory has to be
+    shared between the API and the job workers.
+    """
+    os.makedirs(settings.MEDIA_SPOOL_ROOT, exist_ok=True)
+    path = os.path.join(
+        settings.MEDIA_SPOOL_ROOT,
+        uuid.uuid4().hex + os.path.splitext(upload.name)[1].lower(),
+    )
+    upload.seek(0)
+    with open(path, "wb") as spooled:
+        for chunk in upload.chunks():
+            spooled.write(chunk)
+    upload.seek(0)
+    return path
+
+
+def remove_spooled(path):
+    if path is not None and os.path.exists(path):
+        os.remove(path)
+
+
+# Cover image derivatives
+
+COVER_VARIANT_EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg"}
+THUMBNAIL_SIZE = 150
+
+
+def make_cover_derivatives(song, source_path=None):
+    """Decode the cover once and store it downscaled to every configured size
+    in every configured format.
+
+    The cover is read from `source_path` (a spooled copy of the upload, see
+    `spool_upload`) when given, so that it is not downloaded from the storage
+    again. Returns the stored file names as {"<size>": {"<format>": name}}.
+    """
+    if source_path is not None and os.path.exists(source_path):
+        image_read = open(source_path, "rb")
+    else:
+        image_read = storage.open(song.cover_img.name, "rb")
+    with image_read:
+        encoded = encode_cover_derivatives(image_read)
+    return store_cover_derivatives(song, encoded)
+
+
+def encode_cover_derivatives(image_file):
+    """Encode the cover image read from `image_file` at every configured size
+    in every configured format, returned as {"<size>": {"<format>": bytes}}.
+
+    JPEG covers are decoded straight at a reduced scale and other formats are
+    reduced before resampling, so the full resolution image is never held in
+    memory. Sizes not smaller than the cover itself are skipped.
+    """
+    largest = max(settings.COVER_DERIVATIVE_SIZES)
+    image = Image.open(image_file)
+    original_size = image.size
+    image.draft("RGB", (largest, largest))
+    image.thumbnail((largest, largest), Image.Resampling.LANCZOS, reducing_gap=3.0)
+    image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        # converted straight to RGB transparent areas turn black
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    encoded = {}
+    source = image
+    for size in sorted(settings.COVER_DERIVATIVE_SIZES, reverse=True):
+        if max(original_size) <= size:
+            continue
+        # every size is scaled down from the previous, larger one
+        source = source.copy()
+        source.thumbnail((size, size), Image.Resampling.LANCZOS)
+        encoded[str(size)] = {}
+        for image_format in settings.COVER_DERIVATIVE_FORMATS:
+            buffer = BytesIO()
+            source.save(buffer, image_format, quality=80, optimize=True)
+            encoded[str(size)][image_format.lower()] = buffer.getvalue()
+    return encoded
+
+
+def store_cover_derivatives(song, encoded):
+    """Store the output of `encode_cover_derivatives` for the song and return
+    the stored file names in the same layout."""
+    return {
+        size: {
+            image_format: storage.save(
+                upload_cover_variant_to(
+                    song, size, COVER_VARIANT_EXTENSIONS[image_format.upper()]
+                ),
+                ContentFile(content),
+            )
+            for image_format, content in formats.items()
+        }
+        for size, formats in encoded.items()
+    }
+
+
+def get_cover_derivative_names(song):
+    names = {
+        name for formats in song.cover_variants.values() for name in formats.values()
+    }
+    if song.thumbnail:
+        names.add(song.thumbnail.name)
+    return names
+
+
+# Bulk storage operations
 
 
-def make_thumbnail(song):
-    with storage.open(song.cover_img.name, "r") as image_read:
-        image = Image.open(image_read)
-        if image.height > 150 or image.width > 150:
-            size = (150, 150)
-            imageBuffer = BytesIO()
-            image.thumbnail(size)
-            # Save the image as jpeg, png, etc. to the buffer
-            image.save(imageBuffer, image.format)
-            # Save the modified image
-            song.thumbnail.save(
-                song.cover_img.name, ContentFile(imageBuffer.getvalue())
+def delete_stored_files(names):
+    """Delete stored files, with one API call per 100 files on Cloudinary."""
+    names = sorted(names)
+    if isinstance(storage, MediaCloudinaryStorage):
+        for start in range(0, len(names), 100):
+            cloudinary.api.delete_resources(
+                names[start : start + 100],
+                resource_type=storage.RESOURCE_TYPE,
+                invalidate=True,
             )
+        return
+    for name in names:
+        storage.delete(name)
+
+
+def list_stored_files(path):
+    """Names of all the stored files under the `path` directory."""
+    if isinstance(storage, MediaCloudinaryStorage):
+        # a single listing by prefix instead of one per directory
+        return get_resources_by_path(
+            storage.RESOURCE_TYPE,
+            storage.TAG,
+            storage._prepend_prefix(path.rstrip("/") + "/"),
+        )
+    if not storage.exists(path):
+        return []
+    directories, files = storage.listdir(path)
+    names = [f"{path}/{filename}" for filename in files]
+    for directory in directories:
+        names.extend(list_stored_files(f"{path}/{directory}"))
+    return names
@@ -1,5 +1,13 @@
+import re
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage as storage
+from django.db import transaction
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.http import parse_etags
 from rest_framework import filters, viewsets
 from rest_framework.decorators import (
     action,
@@ -7,15 +15,21 @@ from rest_framework.decorators import (
     authentication_classes,
     permission_classes,
 )
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.generics import CreateAPIView, GenericAPIView, ListAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
-from music_player_api.models import Genre, Playlist, Song, SongPlaylist
+from music_player_api.filters import FullTextSearchFilter
+from music_player_api.jobs import enqueue
+from music_player_api.mediaurls import verify_media_signature
+from music_player_api.models import Genre, Playlist, Song, SongPlaylist, SongWaveform
+from music_player_api.pagination import PlaylistTracksPagination
 from music_player_api.permissions import IsSameUserOrReadonly
 from music_player_api.serializers import (
+    BulkDeleteSongsSerializer,
     ChangePasswordForgotSerializer,
     ChangePasswordSerializer,
     CodeWithEmailSerializer,
@@ -27,13 +41,37 @@ from music_player_api.serializers import (
     GetFlatPlaylistSerializer,
     GetFlatSongSerializer,
     GetGenreSerializer,
+    GetSongInPlaylistSerializer,
     GetSongSerializer,
+    PlaylistOperationsSerializer,
     RegisterUserSerializer,
+    SuggestQuerySerializer,
+    UploadSessionSerializer,
     UserInfoSerializer,
 )
+from music_player_api.streaming import serve_media
+from music_player_api.uploadhandlers import ValidatedUploadsMixin
+from music_player_api.utils import GenreCatalogCache
 
 User = get_user_model()
 
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+# Media views
+
+
+@api_view(["GET"])
+@authentication_classes([])
+@permission_classes([])
+def signed_media(request, expires, signature, name):
+    """Serve a stored file to holders of a signed URL, see `MediaURLCache`."""
+    if not verify_media_signature(name, expires, signature):
+        return Response({"errors": ["Invalid or expired link."]}, 403)
+    if not storage.exists(name):
+        raise NotFound()
+    return serve_media(request, name)
+
 
 # User model views
 
@@ -73,7 +111,7 @@ def change_my_password(request):
     return Response({"message": "Successfully changed password."}, 200)
 
 
-class UserInfoViewSet(viewsets.GenericViewSet):
+class UserInfoViewSet(ValidatedUploadsMixin, viewsets.GenericViewSet):
     queryset = User.objects.all()
     serializer_class = UserInfoSerializer
     permission_classes = (IsAuthenticated,)
@@ -92,7 +130,12 @@ class UserInfoViewSet(viewsets.GenericViewSet):
 
     @action(detail=False, methods=["delete"])
     def delete_current(self, request):
-        request.user.delete()
+        """Deactivate the account at once, so that its tokens stop working,
+        and leave deleting it with its songs and playlists to a job."""
+        with transaction.atomic():
+            request.user.is_active = False
+            request.user.save(update_fields=["is_active"])
+            enqueue("delete_user", user_id=request.user.id)
         return Response({"success": "User successfully deleted."}, 204)
 
 
@@ -141,10 +184,9 @@ class ForgotPasswordViewSet(viewsets.GenericViewSet):
 
 # Search related views
 class SearchAllPlayliststAPIView(ListAPIView):
-    queryset = Playlist.objects.all()
+    queryset = Playlist.objects.select_related("added_by")
     serializer_class = GetFlatPlaylistSerializer
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ["name", "songs__title", "songs__author", "songs__genres__name"]
+    filter_backends = [filters.OrderingFilter, FullTextSearchFilter]
     ordering_fields = ["id"]
     ordering = ["-id"]
 
@@ -152,20 +194,18 @@ class SearchAllPlayliststAPIView(ListAPIView):
 class SearchMyPlaylistsAPIView(ListAPIView):
     serializer_class = GetFlatPlaylistSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ["name", "songs__title", "songs__author", "songs__genres__name"]
+    filter_backends = [filters.OrderingFilter, FullTextSearchFilter]
     ordering_fields = ["id"]
     ordering = ["-id"]
 
     def get_queryset(self):
-        return self.request.user.playlists.all()
+        return self.request.user.playlists.select_related("added_by")
 
 
 class SearchAllSongsAPIView(ListAPIView):
-    queryset = Song.objects.all()
+    queryset = Song.objects.with_related()
     serializer_class = GetFlatSongSerializer
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ["title", "genres__name", "author"]
+    filter_backends = [filters.OrderingFilter, FullTextSearchFilter]
     ordering_fields = ["id"]
     ordering = ["-id"]
 
@@ -177,9 +217,8 @@ class SearchAllSongsAPIView(ListAPIView):
 
 class SearchMySongsAPIView(ListAPIView):
     serializer_class = GetFlatSongSerializer
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [filters.OrderingFilter, FullTextSearchFilter]
     permission_classes = [IsAuthenticated]
-    search_fields = ["title", "genres__name", "author"]
     ordering_fields = ["id"]
     ordering = ["-id"]
 
@@ -189,26 +228,82 @@ class SearchMySongsAPIView(ListAPIView):
         return context
 
     def get_queryset(self):
-        return self.request.user.songs.all()
+        return self.request.user.songs.with_related()
+
+
+class SuggestAPIView(GenericAPIView):
+    """Autocomplete over songs, playlists and genres for search-as-you-type.
+
+    Returns at most `limit` tiny id/label records ranked by trigram word
+    similarity, each kind served by its own trigram GIN index.
+    """
+
+    serializer_class = SuggestQuerySerializer
+
+    def get(self, request):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        text = serializer.validated_data["q"]
+        limit = serializer.validated_data["limit"]
+
+        suggestions = []
+        for kind, queryset in (
+            ("song", Song.objects.all()),
+            ("playlist", Playlist.objects.all()),
+            ("genre", Genre.objects.all()),
+        ):
+            suggestions.extend(
+                {"type": kind, **match} for match in queryset.suggest(text)[:limit]
+            )
+        suggestions.sort(key=lambda match: -match["score"])
+        return Response(
+            [
+                {"type": match["type"], "id": match["id"], "label": match["label"]}
+                for match in suggestions[:limit]
+            ],
+            200,
+        )
 
 
 # Genres model views
 
 
 class GetAvailableGenres(ListAPIView):
+    """Genre catalog served from cache, with ETag based conditional GET.
+
+    A matching If-None-Match is answered with 304 without touching the
+    database or serializing anything.
+    """
+
     pagination_class = None
     queryset = Genre.objects.all()
     serializer_class = GetGenreSerializer
 
+    def list(self, request, *args, **kwargs):
+        version = GenreCatalogCache.get_version()
+        headers = {
+            "ETag": GenreCatalogCache.get_etag(version),
+            "Cache-Control": "no-cache",
+        }
+        if_none_match = parse_etags(request.headers.get("If-None-Match", ""))
+        if headers["ETag"] in if_none_match or "*" in if_none_match:
+            return Response(status=304, headers=headers)
+
+        data = GenreCatalogCache.get_payload(version)
+        if data is None:
+            data = self.get_serializer(self.get_queryset(), many=True).data
+            GenreCatalogCache.set_payload(version, data)
+        return Response(data, 200, headers=headers)
+
 
 # Song model views
 
 
-class SongViewSet(viewsets.ModelViewSet):
-    queryset = Song.objects.all()
+class SongViewSet(ValidatedUploadsMixin, viewsets.ModelViewSet):
+    queryset = Song.objects.with_related()
 
     def get_permissions(self):
-        if self.action in ("retrieve", "create"):
+        if self.action in ("retrieve", "create", "bulk_delete", "stream", "waveform"):
             permission_classes = [IsAuthenticated]
         else:
             permission_classes = [IsSameUserOrReadonly]
@@ -219,6 +314,35 @@ class SongViewSet(viewsets.ModelViewSet):
         self.check_object_permissions(self.request, obj)
         return obj
 
+    @action(detail=False, methods=["post"])
+    def bulk_delete(self, request):
+        serializer = BulkDeleteSongsSerializer(
+            data=request.data, context={"user": request.user}
+        )
+        serializer.is_valid(raise_exception=True)
+        song_ids = serializer.save()
+        return Response(
+            {"success": f"{len(song_ids)} song(s) scheduled for deletion."}, 202
+        )
+
+    @action(detail=True, methods=["get"])
+    def stream(self, request, pk=None):
+        song = self.get_object()
+        if not song.audio_file:
+            raise NotFound()
+        return serve_media(request, song.audio_file.name)
+
+    @action(detail=True, methods=["get"])
+    def waveform(self, request, pk=None):
+        """Waveform peaks as raw bytes, one (0-255) per slice of the track.
+        They never change for a song, so clients may cache them for good."""
+        waveform = get_object_or_404(SongWaveform, song_id=pk)
+        response = HttpResponse(
+            bytes(waveform.peaks), content_type="application/octet-stream"
+        )
+        response["Cache-Control"] = "private, max-age=31536000, immutable"
+        return response
+
     def get_serializer_class(self):
         if self.action == "partial_update":
             return EditSongSerializer
@@ -232,14 +356,73 @@ class SongViewSet(viewsets.ModelViewSet):
         return context
 
 
+class UploadSessionViewSet(viewsets.GenericViewSet):
+    """Resumable chunked uploads.
+
+    A session is opened with the file name and size, then the file is sent in
+    consecutive `PATCH` requests carrying a `Content-Range: bytes a-b/size`
+    header. After a dropped connection the client fetches the session to
+    learn the offset to resume from.
+    """
+
+    serializer_class = UploadSessionSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return self.request.user.upload_sessions.filter(
+            created_at__gte=timezone.now() - settings.UPLOAD_SESSION_TTL
+        )
+
+    @action(detail=False, methods=["post"])
+    def create(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, 201)
+
+    @action(detail=True, methods=["get"])
+    def retrieve(self, request, pk=None):
+        return Response(self.get_serializer(self.get_object()).data, 200)
+
+    @action(detail=True, methods=["patch"])
+    def append_chunk(self, request, pk=None):
+        match = CONTENT_RANGE_RE.match(request.headers.get("Content-Range", ""))
+        if match is None:
+            raise ValidationError("Content-Range header of the chunk is required.")
+        start, end, size = map(int, match.groups())
+        length = end - start + 1
+        if length <= 0:
+            raise ValidationError("Content-Range of the chunk is empty.")
+        if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+            raise ValidationError("Chunk is too large.")
+        with transaction.atomic():
+            session = self.get_queryset().select_for_update().filter(pk=pk).first()
+            if session is None:
+                raise NotFound()
+            if size != session.size or end >= session.size:
+                raise ValidationError("Content-Range does not match the file size.")
+            if start != session.offset:
+                # resume from the offset in the response
+                return Response(self.get_serializer(session).data, 409)
+            if not session.append(request, length):
+                raise ValidationError("Chunk is shorter than its Content-Range.")
+        return Response(self.get_serializer(session).data, 200)
+
+    @action(detail=True, methods=["delete"])
+    def destroy(self, request, pk=None):
+        self.get_object().delete()
+        return Response(status=204)
+
+
 # Playlist model views
 
 
 class PlaylistViewSet(viewsets.GenericViewSet):
-    queryset = Playlist.objects.all()
+    queryset = Playlist.objects.select_related("added_by")
+    pagination_class = PlaylistTracksPagination
 
     def get_permissions(self):
-        if self.action in ("retrieve", "create"):
+        if self.action in ("retrieve", "create", "list_tracks"):
             permission_classes = [IsAuthenticated]
         else:
             permission_classes = [IsSameUserOrReadonly]
@@ -254,10 +437,19 @@ class PlaylistViewSet(viewsets.GenericViewSet):
     def retrieve(self, request, pk=None):
         playlist = self.get_object()
         serializer = GetDeepPlaylistSerializer(
-            instance=playlist, context={"user": request.user}
+            instance=playlist, context={"user": request.user, "request": request}
         )
         return Response(serializer.data, 200)
 
+    @action(detail=True, methods=["get"])
+    def list_tracks(self, request, pk=None):
+        playlist = self.get_object()
+        page = self.paginate_queryset(playlist.get_ordered_songs())
+        serializer = GetSongInPlaylistSerializer(
+            page, many=True, context={"user": request.user, "request": request}
+        )
+        return self.get_paginated_response(serializer.data)
+
     @action(detail=False, methods=["post"])
     def create(self, request):
         serializer = CreateUpdatePlaylistSerializer(
@@ -266,7 +458,7 @@ class PlaylistViewSet(viewsets.GenericViewSet):
         serializer.is_valid(raise_exception=True)
         playlist = serializer.save()
         response_serializer = GetDeepPlaylistSerializer(
-            instance=playlist, context={"user": request.user}
+            instance=playlist, context={"user": request.user, "request": request}
         )
         return Response(response_serializer.data, 201)
 
@@ -279,7 +471,20 @@ class PlaylistViewSet(viewsets.GenericViewSet):
         serializer.is_valid(raise_exception=True)
         playlist = serializer.save()
         response_serializer = GetDeepPlaylistSerializer(
-            instance=playlist, context={"user": request.user}
+            instance=playlist, context={"user": request.user, "request": request}
+        )
+        return Response(response_serializer.data, 200)
+
+    @action(detail=True, methods=["post"])
+    def apply_operations(self, request, pk=None):
+        playlist = self.get_object()
+        serializer = PlaylistOperationsSerializer(
+            data=request.data, context={"playlist": playlist}
+        )
+        serializer.is_valid(raise_exception=True)
+        playlist = serializer.save()
+        response_serializer = GetDeepPlaylistSerializer(
+            instance=playlist, context={"user": request.user, "request": request}
         )
         return Response(response_serializer.data, 200)
 
@@ -1,6 +1,6 @@
 import factory
 from faker import Faker
-from music_player_api.models import User
+from music_player_api.models import Genre, Playlist, Song, SongPlaylist, User
 from pytest_factoryboy import register
 
 fake = Faker()
@@ -11,8 +11,46 @@ class UserFactory(factory.django.DjangoModelFactory):
     class Meta:
         model = User
 
-    email = fake.email()
+    email = factory.Sequence(lambda n: f"{n}{fake.email()}")
     first_name = fake.first_name()
     last_name = fake.last_name()
     is_staff = "False"
     is_superuser = "False"
+
+
+@register
+class GenreFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = Genre
+
+    name = factory.Sequence(lambda n: f"{fake.word()} {n}")
+
+
+@register
+class SongFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = Song
+
+    added_by = factory.SubFactory(UserFactory)
+    title = factory.LazyFunction(lambda: fake.sentence(nb_words=3))
+    author = factory.LazyFunction(fake.name)
+    lyrics = factory.LazyFunction(fake.text)
+
+
+@register
+class PlaylistFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = Playlist
+
+    name = factory.LazyFunction(lambda: fake.sentence(nb_words=2))
+    added_by = factory.SubFactory(UserFactory)
+
+
+@register
+class SongPlaylistFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = SongPlaylist
+
+    song = factory.SubFactory(SongFactory)
+    playlist = factory.SubFactory(PlaylistFactory)
+    order_num = factory.Sequence(lambda n: n)
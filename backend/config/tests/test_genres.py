@@ -0,0 +1,37 @@
+import pytest
+
+
+@pytest.mark.django_db
+def test_genre_catalog_conditional_get(
+    client,
+    django_assert_num_queries,
+    django_capture_on_commit_callbacks,
+    genre_factory,
+):
+    with django_capture_on_commit_callbacks(execute=True):
+        genres = genre_factory.create_batch(3)
+
+    with django_assert_num_queries(1):
+        response = client.get("/api/get-available-genres/")
+    assert response.status_code == 200
+    assert {genre["id"] for genre in response.json()} == {g.id for g in genres}
+    etag = response["ETag"]
+
+    # served from cache
+    with django_assert_num_queries(0):
+        response = client.get("/api/get-available-genres/")
+    assert response.status_code == 200
+    assert response["ETag"] == etag
+
+    with django_assert_num_queries(0):
+        response = client.get("/api/get-available-genres/", HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    # any change of the catalog invalidates the ETag
+    with django_capture_on_commit_callbacks(execute=True):
+        genres[0].name = "Renamed"
+        genres[0].save()
+    response = client.get("/api/get-available-genres/", HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response["ETag"] != etag
+    assert "Renamed" in {genre["name"] for genre in response.json()}
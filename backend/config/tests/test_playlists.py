@@ -0,0 +1,269 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from music_player_api.mediaurls import MediaURLCache
+from music_player_api.serializers import (
+    CreateUpdatePlaylistSerializer,
+    PlaylistOperationsSerializer,
+)
+
+
+def create_playlist_with_songs(
+    user_factory, playlist_factory, song_factory, genre_factory, song_count
+):
+    owner = user_factory.create()
+    playlist = playlist_factory.create(added_by=owner)
+    genres = genre_factory.create_batch(3)
+    songs = []
+    for i in range(song_count):
+        song = song_factory.create(added_by=user_factory.create(), duration=60.5)
+        song.genres.set(genres[: i % 3 + 1])
+        songs.append(song)
+    # insert in reverse so that the DB order differs from the insertion order
+    for order_num, song in reversed(list(enumerate(songs))):
+        playlist.songplaylist_set.create(song=song, order_num=order_num)
+    return owner, playlist, songs
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("song_count", [1, 25])
+def test_playlist_detail_query_count(
+    client,
+    auth_headers,
+    django_assert_num_queries,
+    user_factory,
+    playlist_factory,
+    song_factory,
+    genre_factory,
+    song_count,
+):
+    owner, playlist, songs = create_playlist_with_songs(
+        user_factory, playlist_factory, song_factory, genre_factory, song_count
+    )
+    headers = auth_headers(owner)
+
+    # auth user, playlist with owner, duration, ordered songs with owners, genres
+    with django_assert_num_queries(5):
+        response = client.get(f"/api/playlists/{playlist.id}/", **headers)
+    assert response.status_code == 200
+
+    data = response.json()
+    assert data["canEdit"] is True
+    assert data["duration"] == 60.5 * song_count
+    assert [song["id"] for song in data["songs"]] == [song.id for song in songs]
+    assert [song["orderNum"] for song in data["songs"]] == list(range(song_count))
+    for song_data, song in zip(data["songs"], songs):
+        assert song_data["addedBy"] == song.added_by.email
+        assert sorted(song_data["genres"]) == sorted(
+            song.genres.values_list("id", flat=True)
+        )
+        assert song_data["canEdit"] is False
+
+
+def reorder_query_count(playlist, song_ids_ordered):
+    serializer = CreateUpdatePlaylistSerializer(
+        data={"song_ids_ordered": song_ids_ordered},
+        context={"playlist": playlist},
+        partial=True,
+    )
+    with CaptureQueriesContext(connection) as queries:
+        assert serializer.is_valid()
+        serializer.save()
+    return len(queries)
+
+
+@pytest.mark.django_db
+def test_playlist_rewrite_is_diff_based(
+    user_factory, playlist_factory, song_factory, genre_factory
+):
+    query_counts = []
+    for song_count in (5, 40):
+        _, playlist, songs = create_playlist_with_songs(
+            user_factory, playlist_factory, song_factory, genre_factory, song_count
+        )
+        song_ids = [song.id for song in songs]
+        entry_ids = set(playlist.songplaylist_set.values_list("id", flat=True))
+
+        # move the last track to the top
+        song_ids = song_ids[-1:] + song_ids[:-1]
+        query_counts.append(reorder_query_count(playlist, song_ids))
+        assert list(playlist.get_ordered_songs().values_list("id", flat=True)) == (
+            song_ids
+        )
+        # rows are updated in place rather than recreated
+        assert set(playlist.songplaylist_set.values_list("id", flat=True)) == entry_ids
+
+    assert query_counts[0] == query_counts[1]
+
+    # additions and removals in the same rewrite
+    new_song = song_factory.create()
+    song_ids = [new_song.id] + song_ids[2:]
+    reorder_query_count(playlist, song_ids)
+    assert list(playlist.get_ordered_songs().values_list("id", flat=True)) == song_ids
+
+    serializer = CreateUpdatePlaylistSerializer(
+        data={"song_ids_ordered": song_ids + [new_song.id + 1000]},
+        context={"playlist": playlist},
+        partial=True,
+    )
+    assert not serializer.is_valid()
+    assert serializer.errors["song_ids_ordered"] == [
+        f"Songs [{new_song.id + 1000}] do not exist."
+    ]
+
+
+@pytest.mark.django_db
+def test_playlist_operations(
+    client, auth_headers, user_factory, playlist_factory, song_factory, genre_factory
+):
+    owner, playlist, songs = create_playlist_with_songs(
+        user_factory, playlist_factory, song_factory, genre_factory, 4
+    )
+    headers = auth_headers(owner)
+    new_songs = song_factory.create_batch(2)
+
+    def apply(*operations):
+        return client.post(
+            f"/api/playlists/{playlist.id}/operations/",
+            data={"operations": list(operations)},
+            content_type="application/json",
+            **headers,
+        )
+
+    response = apply(
+        {"op": "move", "songId": songs[3].id, "position": 0},
+        {"op": "insert", "songId": new_songs[0].id, "position": 2},
+        {"op": "remove", "songId": songs[1].id},
+        {"op": "append", "songId": new_songs[1].id},
+    )
+    assert response.status_code == 200
+    expected = [songs[3], songs[0], new_songs[0], songs[2], new_songs[1]]
+    assert [song["id"] for song in response.json()["songs"]] == [
+        song.id for song in expected
+    ]
+
+    # a failing operation rolls the whole batch back
+    response = apply(
+        {"op": "remove", "songId": songs[0].id},
+        {"op": "append", "songId": songs[3].id},
+    )
+    assert response.status_code == 400
+    assert playlist.songplaylist_set.filter(song=songs[0]).exists()
+
+    # only the owner may change the playlist
+    response = client.post(
+        f"/api/playlists/{playlist.id}/operations/",
+        data={"operations": [{"op": "remove", "songId": songs[0].id}]},
+        content_type="application/json",
+        **auth_headers(user_factory.create()),
+    )
+    assert response.status_code == 403
+
+
+@pytest.mark.django_db
+def test_playlist_move_renumbers_when_gap_is_exhausted(
+    playlist_factory, song_playlist_factory, song_factory
+):
+    playlist = playlist_factory.create()
+    songs = song_factory.create_batch(3)
+    for order_num, song in enumerate(songs):
+        song_playlist_factory.create(song=song, playlist=playlist, order_num=order_num)
+
+    serializer = PlaylistOperationsSerializer(
+        data={"operations": [{"op": "move", "song_id": songs[2].id, "position": 1}]},
+        context={"playlist": playlist},
+    )
+    assert serializer.is_valid()
+    serializer.save()
+    assert list(playlist.get_ordered_songs()) == [songs[0], songs[2], songs[1]]
+
+    # with free values around, a move touches only the moved row
+    serializer = PlaylistOperationsSerializer(
+        data={"operations": [{"op": "move", "song_id": songs[0].id, "position": 1}]},
+        context={"playlist": playlist},
+    )
+    assert serializer.is_valid()
+    untouched = dict(playlist.songplaylist_set.values_list("song_id", "order_num"))
+    serializer.save()
+    stored = dict(playlist.songplaylist_set.values_list("song_id", "order_num"))
+    assert list(playlist.get_ordered_songs()) == [songs[2], songs[0], songs[1]]
+    assert stored[songs[1].id] == untouched[songs[1].id]
+    assert stored[songs[2].id] == untouched[songs[2].id]
+
+
+@pytest.mark.django_db
+def test_playlist_tracks_cursor_pagination(
+    client, auth_headers, user_factory, song_factory
+):
+    owner = user_factory.create()
+    headers = auth_headers(owner)
+    songs = song_factory.create_batch(60)
+    response = client.post(
+        "/api/playlists/",
+        data={"name": "Long one", "songIdsOrdered": [song.id for song in songs]},
+        content_type="application/json",
+        **headers,
+    )
+    assert response.status_code == 201
+    data = response.json()
+    first_page = [song["id"] for song in data["songs"]]
+    assert first_page == [song.id for song in songs[:50]]
+
+    received = []
+    next_url = f"/api/playlists/{data['id']}/tracks/?page_size=25"
+    while next_url:
+        response = client.get(next_url, **headers)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page["results"]) <= 25
+        received.extend(song["id"] for song in page["results"])
+        next_url = page["next"]
+    assert received == [song.id for song in songs]
+
+    response = client.get(data["songsNext"], **headers)
+    assert [song["id"] for song in response.json()["results"]] == [
+        song.id for song in songs[50:]
+    ]
+
+
+@pytest.mark.django_db
+def test_playlist_song_media_urls_are_absolute(
+    client, auth_headers, local_storage, settings, user_factory, song_factory
+):
+    MediaURLCache.clear()
+    settings.MEDIA_SIGNED_URLS = True
+    owner = user_factory.create()
+    headers = auth_headers(owner)
+    song = song_factory.create(
+        audio_file="uploads/blobs/aa/aa.mp3",
+        thumbnail="uploads/songs/1/cover_150.jpg",
+        cover_variants={"150": {"jpeg": "uploads/songs/1/cover_150.jpg"}},
+        audio_renditions={
+            "master": "uploads/songs/1/hls/master.m3u8",
+            "renditions": {"64": "uploads/songs/1/hls/64k.m3u8"},
+            "files": [],
+        },
+    )
+    response = client.post(
+        "/api/playlists/",
+        data={"name": "Signed", "songIdsOrdered": [song.id]},
+        content_type="application/json",
+        **headers,
+    )
+    assert response.status_code == 201
+    playlist_id = response.json()["id"]
+
+    for songs in [
+        client.get(f"/api/playlists/{playlist_id}/", **headers).json()["songs"],
+        client.get(f"/api/playlists/{playlist_id}/tracks/", **headers).json()[
+            "results"
+        ],
+    ]:
+        urls = [
+            songs[0]["audioFile"],
+            songs[0]["thumbnail"],
+            songs[0]["coverSrcset"]["150"]["jpeg"],
+            songs[0]["hls"]["master"],
+            songs[0]["hls"]["renditions"]["64"],
+        ]
+        assert all(url.startswith("http://testserver/api/media/") for url in urls)
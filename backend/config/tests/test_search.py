@@ -0,0 +1,158 @@
+import pytest
+from django.db import transaction
+from music_player_api.models import Playlist, schedule_playlist_search_update
+from music_player_api.search import build_search_query
+
+
+def search_ids(client, path, text, **headers):
+    response = client.get(path, {"search": text}, **headers)
+    assert response.status_code == 200
+    return [entry["id"] for entry in response.json()["results"]]
+
+
+@pytest.mark.django_db
+def test_song_full_text_search(client, song_factory, genre_factory):
+    jazz = genre_factory.create(name="Smooth Jazz")
+    by_title = song_factory.create(title="Blue in Green", author="Miles Davis")
+    by_author = song_factory.create(title="So What", author="Bluesbreakers")
+    by_lyrics = song_factory.create(title="Untitled", lyrics="feeling blue today")
+    by_genre = song_factory.create(title="Something else", author="Someone")
+    by_genre.genres.add(jazz)
+    song_factory.create(title="Green Onions", author="Booker T", lyrics="")
+
+    found = search_ids(client, "/api/all-songs/", "blu")
+    assert set(found) == {by_title.id, by_author.id, by_lyrics.id}
+    # title and author matches outrank lyrics matches
+    assert found[-1] == by_lyrics.id
+
+    assert search_ids(client, "/api/all-songs/", "smooth") == [by_genre.id]
+    assert search_ids(client, "/api/all-songs/", "blue green") == [by_title.id]
+    assert search_ids(client, "/api/all-songs/", "?!") == []
+
+    # the stored vector follows edits of songs and genres
+    jazz.name = "Bebop"
+    jazz.save()
+    assert search_ids(client, "/api/all-songs/", "smooth") == []
+    assert search_ids(client, "/api/all-songs/", "bebop") == [by_genre.id]
+    jazz.songs.clear()
+    assert search_ids(client, "/api/all-songs/", "bebop") == []
+    by_lyrics.title = "Bebop tune"
+    by_lyrics.save()
+    assert search_ids(client, "/api/all-songs/", "bebop") == [by_lyrics.id]
+
+
+@pytest.mark.django_db
+def test_playlist_full_text_search(
+    client,
+    auth_headers,
+    django_capture_on_commit_callbacks,
+    user_factory,
+    playlist_factory,
+    song_factory,
+    genre_factory,
+):
+    user = user_factory.create()
+    headers = auth_headers(user)
+    with django_capture_on_commit_callbacks(execute=True):
+        rock = genre_factory.create(name="Rock")
+        song = song_factory.create(title="Paranoid", author="Black Sabbath")
+        song.genres.add(rock)
+        by_name = playlist_factory.create(name="Rock classics", added_by=user)
+        by_song = playlist_factory.create(name="Workout", added_by=user)
+        by_song.songplaylist_set.create(song=song, order_num=1)
+        other = playlist_factory.create(name="Rock ballads")
+
+    found = search_ids(client, "/api/all-playlists/", "rock")
+    assert set(found) == {by_name.id, by_song.id, other.id}
+    # name matches outrank genre matches
+    assert found[-1] == by_song.id
+    assert search_ids(client, "/api/all-playlists/", "sabbath") == [by_song.id]
+    assert set(search_ids(client, "/api/my-playlists/", "rock", **headers)) == {
+        by_name.id,
+        by_song.id,
+    }
+
+
+@pytest.mark.django_db
+def test_playlist_search_document_is_maintained(
+    client,
+    django_capture_on_commit_callbacks,
+    playlist_factory,
+    song_factory,
+    genre_factory,
+):
+    with django_capture_on_commit_callbacks(execute=True):
+        genre = genre_factory.create(name="Grunge")
+        song = song_factory.create(title="Lithium", author="Nirvana")
+        playlist = playlist_factory.create(name="Nineties")
+        playlist.songplaylist_set.create(song=song, order_num=1)
+    assert search_ids(client, "/api/all-playlists/", "lithium") == [playlist.id]
+
+    with django_capture_on_commit_callbacks(execute=True):
+        song.genres.add(genre)
+    assert search_ids(client, "/api/all-playlists/", "grunge") == [playlist.id]
+
+    with django_capture_on_commit_callbacks(execute=True):
+        genre.name = "Alternative"
+        genre.save()
+        song.title = "Polly"
+        song.save()
+    assert search_ids(client, "/api/all-playlists/", "grunge") == []
+    assert search_ids(client, "/api/all-playlists/", "alternative polly") == [
+        playlist.id
+    ]
+
+    with django_capture_on_commit_callbacks(execute=True):
+        song.delete()
+    assert search_ids(client, "/api/all-playlists/", "polly") == []
+    assert search_ids(client, "/api/all-playlists/", "nineties") == [playlist.id]
+
+    # playlist search reads a single table
+    sql = str(Playlist.objects.search(build_search_query("x")).query)
+    assert "JOIN" not in sql
+
+
+@pytest.mark.django_db
+def test_playlist_search_updates_of_rolled_back_savepoints_are_dropped(
+    django_capture_on_commit_callbacks, playlist_factory
+):
+    rolled_back, updated = playlist_factory.create_batch(2)
+    Playlist.objects.update(search_vector=None)
+    with django_capture_on_commit_callbacks(execute=True):
+        with pytest.raises(RuntimeError):
+            with transaction.atomic():
+                schedule_playlist_search_update([rolled_back.pk])
+                raise RuntimeError
+        schedule_playlist_search_update([updated.pk])
+    assert set(
+        Playlist.objects.filter(search_vector__isnull=False).values_list(
+            "pk", flat=True
+        )
+    ) == {updated.pk}
+
+
+@pytest.mark.django_db
+def test_search_suggest(client, song_factory, playlist_factory, genre_factory):
+    song = song_factory.create(title="Bohemian Rhapsody", author="Queen")
+    playlist = playlist_factory.create(name="Queens of the night")
+    genre = genre_factory.create(name="Bossa Nova")
+    song_factory.create(title="Yesterday", author="The Beatles")
+
+    response = client.get("/api/search/suggest/", {"q": "bohem"})
+    assert response.status_code == 200
+    assert response.json() == [
+        {"type": "song", "id": song.id, "label": "Bohemian Rhapsody - Queen"}
+    ]
+
+    # typo tolerant, matched against authors and playlist names too
+    response = client.get("/api/search/suggest/", {"q": "queeen"})
+    assert {(entry["type"], entry["id"]) for entry in response.json()} == {
+        ("song", song.id),
+        ("playlist", playlist.id),
+    }
+
+    response = client.get("/api/search/suggest/", {"q": "bossa", "limit": 1})
+    assert response.json() == [{"type": "genre", "id": genre.id, "label": "Bossa Nova"}]
+
+    response = client.get("/api/search/suggest/")
+    assert response.status_code == 400
@@ -0,0 +1,1089 @@
+import json
+import os
+import struct
+import time
+import wave
+from datetime import timedelta
+from io import BytesIO, StringIO
+
+import pytest
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.http import Http404
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.utils import timezone
+from music_player_api.jobs import (
+    _handlers,
+    claim_next_job,
+    enqueue,
+    run_job,
+    run_pending_jobs,
+)
+from music_player_api.mediaurls import MediaURLCache
+from music_player_api.models import (
+    DeletedFile,
+    Job,
+    MediaBlob,
+    Song,
+    schedule_file_deletion,
+)
+from music_player_api.search import build_search_query
+from music_player_api.streaming import serve_media
+from music_player_api.utils import encode_cover_derivatives, make_cover_derivatives
+from PIL import Image, ImageFile
+
+
+def create_songs(song_factory, genre_factory, count, **kwargs):
+    genres = genre_factory.create_batch(3)
+    songs = song_factory.create_batch(count, **kwargs)
+    for i, song in enumerate(songs):
+        song.genres.set(genres[: i % 3 + 1])
+    return songs
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("song_count", [3, 25])
+def test_all_songs_query_count(
+    client,
+    auth_headers,
+    django_assert_num_queries,
+    user_factory,
+    song_factory,
+    genre_factory,
+    song_count,
+):
+    user = user_factory.create()
+    headers = auth_headers(user)
+    own_song = song_factory.create(added_by=user)
+    create_songs(song_factory, genre_factory, song_count)
+
+    # auth user, page count, songs with owners, genres
+    with django_assert_num_queries(4):
+        response = client.get("/api/all-songs/", **headers)
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert len(results) == min(song_count + 1, 10)
+    assert all(song["addedBy"] for song in results)
+    assert all(song["genres"] for song in results if song["id"] != own_song.id)
+    for song in results:
+        assert song["canEdit"] == (song["id"] == own_song.id)
+
+    # anonymous requests skip the auth query
+    with django_assert_num_queries(3):
+        response = client.get("/api/all-songs/")
+    assert response.status_code == 200
+    assert not any(song["canEdit"] for song in response.json()["results"])
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("song_count", [3, 25])
+def test_my_songs_query_count(
+    client,
+    auth_headers,
+    django_assert_num_queries,
+    user_factory,
+    song_factory,
+    genre_factory,
+    song_count,
+):
+    user = user_factory.create()
+    headers = auth_headers(user)
+    create_songs(song_factory, genre_factory, song_count, added_by=user)
+    create_songs(song_factory, genre_factory, 5)
+
+    with django_assert_num_queries(4):
+        response = client.get("/api/my-songs/", **headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["count"] == song_count
+    assert all(
+        song["canEdit"] and song["addedBy"] == user.email for song in data["results"]
+    )
+
+
+@pytest.mark.django_db
+def test_all_songs_cursor_pagination(
+    client, django_assert_num_queries, song_factory, genre_factory
+):
+    songs = create_songs(song_factory, genre_factory, 25)
+    expected = [song.id for song in reversed(songs)]
+
+    received = []
+    next_url = "/api/all-songs/?pagination=cursor"
+    while next_url:
+        # no COUNT query: songs with owners and genres only
+        with django_assert_num_queries(2):
+            response = client.get(next_url)
+        assert response.status_code == 200
+        page = response.json()
+        assert "count" not in page
+        received.extend(song["id"] for song in page["results"])
+        next_url = page["next"]
+    assert received == expected
+
+    response = client.get("/api/all-songs/", {"pagination": "cursor", "ordering": "id"})
+    assert [song["id"] for song in response.json()["results"]] == expected[::-1][:10]
+
+    # page numbers stay the default
+    response = client.get("/api/all-songs/", {"page": 2})
+    assert response.json()["count"] == 25
+    assert [song["id"] for song in response.json()["results"]] == expected[10:20]
+
+
+@pytest.mark.django_db
+def test_create_song_defers_media_processing(
+    client,
+    auth_headers,
+    local_storage,
+    user_factory,
+    genre_factory,
+    audio_upload,
+    image_upload,
+    monkeypatch,
+):
+    user = user_factory.create()
+    headers = auth_headers(user)
+    genre = genre_factory.create()
+
+    response = client.post(
+        "/api/songs/",
+        data={
+            "title": "Song",
+            "author": "Author",
+            "genres": [genre.id],
+            "audioFile": audio_upload(),
+            "coverImg": image_upload(),
+        },
+        **headers,
+    )
+    assert response.status_code == 201
+    data = response.json()
+    assert data["processingStatus"] == "pending"
+    song = Song.objects.get(pk=data["id"])
+    assert song.audio_file and song.cover_img and not song.thumbnail
+    # 300 frames of 1152 samples
+    assert song.duration == pytest.approx(300 * 1152 / 44100, abs=0.05)
+    assert (song.bitrate, song.sample_rate, song.codec) == (128000, 44100, "mp3")
+    assert Job.objects.filter(name="process_song_media").count() == 1
+    assert Job.objects.filter(name="transcode_song_audio").count() == 1
+
+    # the uploads are read from the local spool, not from the storage
+    spooled = [
+        Job.objects.get(name="process_song_media").payload["cover_path"],
+        Job.objects.get(name="transcode_song_audio").payload["audio_path"],
+    ]
+    assert all(os.path.exists(path) for path in spooled)
+    storage_open = default_storage.open
+    monkeypatch.setattr(
+        default_storage,
+        "open",
+        lambda name, *args: pytest.fail("read back " + name)
+        if name in (song.cover_img.name, song.audio_file.name)
+        else storage_open(name, *args),
+    )
+    assert run_pending_jobs() == 2
+    assert not any(os.path.exists(path) for path in spooled)
+    song.refresh_from_db()
+    assert song.processing_status == Song.ProcessingStatus.READY
+    assert song.thumbnail
+    assert not Job.objects.exists()
+
+    response = client.get(f"/api/songs/{song.id}/", **headers)
+    assert response.json()["processingStatus"] == "ready"
+    assert response.json()["thumbnail"]
+    assert set(response.json()["coverSrcset"]["300"]) == {"webp", "jpeg"}
+    assert set(response.json()["hls"]["renditions"]) == {"64", "128", "192"}
+    assert response.json()["sampleRate"] == 44100
+
+
+@pytest.mark.django_db
+def test_cover_derivatives(
+    django_capture_on_commit_callbacks, local_storage, song_factory, image_upload
+):
+    song = song_factory.create()
+    cover = image_upload(size=(800, 400))
+    song.cover_img.save(cover.name, cover)
+    enqueue("process_song_media", song_id=song.id)
+    run_pending_jobs()
+
+    song.refresh_from_db()
+    assert set(song.cover_variants) == {"64", "150", "300", "600"}
+    for size, names in song.cover_variants.items():
+        assert set(names) == {"webp", "jpeg"}
+        for image_format, name in names.items():
+            with default_storage.open(name, "rb") as stored:
+                image = Image.open(stored)
+                assert image.format == image_format.upper()
+                assert image.size == (int(size), int(size) // 2)
+    assert song.thumbnail.name == song.cover_variants["150"]["jpeg"]
+
+    # small covers are not upscaled
+    small_cover = image_upload(size=(100, 100))
+    song.cover_img.save(small_cover.name, small_cover)
+    enqueue("process_song_media", song_id=song.id)
+    old_names = [
+        name for names in song.cover_variants.values() for name in names.values()
+    ]
+    with django_capture_on_commit_callbacks(execute=True):
+        run_pending_jobs()
+    # the replaced derivatives go through the deletion queue
+    assert DeletedFile.objects.exists()
+    run_pending_jobs()
+    song.refresh_from_db()
+    assert set(song.cover_variants) == {"64"}
+    assert not song.thumbnail
+    assert not any(
+        default_storage.exists(name)
+        for name in old_names
+        if name not in song.cover_variants["64"].values()
+    )
+
+
+@pytest.mark.parametrize("mode", ["RGBA", "LA", "P"])
+def test_transparent_cover_derivatives_have_a_white_background(mode):
+    # an opaque red left half and a transparent black right half
+    if mode == "P":
+        cover = Image.new("P", (800, 800), 1)
+        cover.putpalette([200, 30, 30, 0, 0, 0])
+        cover.paste(0, (0, 0, 400, 800))
+        cover.info["transparency"] = 1
+    else:
+        cover = Image.new("RGBA", (800, 800), (0, 0, 0, 0))
+        cover.paste((200, 30, 30, 255), (0, 0, 400, 800))
+        cover = cover.convert(mode)
+    buffer = BytesIO()
+    cover.save(buffer, "PNG")
+    buffer.seek(0)
+
+    for formats in encode_cover_derivatives(buffer).values():
+        for content in formats.values():
+            image = Image.open(BytesIO(content)).convert("RGB")
+            assert min(image.getpixel((image.width - 1, 0))) > 240
+            assert min(image.getpixel((0, 0))) < 100
+
+
+@pytest.mark.django_db
+def test_failed_reprocessing_keeps_the_derivatives(
+    local_storage, song_factory, image_upload
+):
+    song = song_factory.create()
+    cover = image_upload(size=(800, 400))
+    song.cover_img.save(cover.name, cover)
+    enqueue("process_song_media", song_id=song.id)
+    run_pending_jobs()
+    song.refresh_from_db()
+    cover_variants = song.cover_variants
+
+    Song.objects.filter(pk=song.id).update(cover_img="missing/cover.png")
+    enqueue("process_song_media", song_id=song.id)
+    assert not run_job(claim_next_job())
+    song.refresh_from_db()
+    assert song.cover_variants == cover_variants
+    assert all(
+        default_storage.exists(name)
+        for names in cover_variants.values()
+        for name in names.values()
+    )
+
+
+@pytest.mark.django_db
+def test_large_jpeg_cover_is_decoded_reduced(
+    local_storage, song_factory, image_upload, monkeypatch
+):
+    song = song_factory.create()
+    cover = image_upload("cover.jpg", size=(4000, 3000), image_format="JPEG")
+    song.cover_img.save(cover.name, cover)
+
+    decoded_sizes = []
+    load = ImageFile.ImageFile.load
+
+    def _load(image):
+        decoded_sizes.append(image.size)
+        return load(image)
+
+    monkeypatch.setattr(ImageFile.ImageFile, "load", _load)
+    variants = make_cover_derivatives(song)
+
+    assert max(decoded_sizes) < (4000, 3000)
+    with default_storage.open(variants["600"]["jpeg"], "rb") as stored:
+        assert Image.open(stored).size == (600, 450)
+
+
+@pytest.mark.django_db
+def test_failing_job_is_retried_then_marked_failed(song_factory, monkeypatch):
+    song = song_factory.create(processing_status=Song.ProcessingStatus.PENDING)
+    song.cover_img.name = "missing/cover.png"
+    song.save()
+    enqueue("process_song_media", song_id=song.id)
+
+    job = claim_next_job()
+    assert run_job(job) is False
+    job.refresh_from_db()
+    assert job.status == Job.Status.PENDING and job.last_error
+    song.refresh_from_db()
+    # not failed yet, the job is retried
+    assert song.processing_status == Song.ProcessingStatus.PROCESSING
+
+    monkeypatch.setattr("music_player_api.jobs.MAX_ATTEMPTS", 2)
+    Job.objects.update(run_after=timezone.now())
+    job = claim_next_job()
+    assert run_job(job) is False
+    job.refresh_from_db()
+    assert job.status == Job.Status.FAILED
+    song.refresh_from_db()
+    assert song.processing_status == Song.ProcessingStatus.FAILED
+
+
+@pytest.mark.django_db
+def test_expired_lease_of_the_last_attempt_fails_the_job(song_factory):
+    song = song_factory.create()
+    # claimed by workers that died running it
+    crashing = enqueue("process_song_media", song_id=song.id)
+    Job.objects.filter(pk=crashing.pk).update(
+        status=Job.Status.RUNNING, attempts=3, run_after=timezone.now()
+    )
+    pending = enqueue("process_song_media", song_id=song.id)
+
+    assert claim_next_job().pk == pending.pk
+    crashing.refresh_from_db()
+    assert crashing.status == Job.Status.FAILED and crashing.attempts == 3
+    assert crashing.last_error
+    song.refresh_from_db()
+    assert song.processing_status == Song.ProcessingStatus.FAILED
+
+
+@pytest.mark.django_db(transaction=True)
+def test_lease_is_renewed_while_the_job_runs(monkeypatch):
+    monkeypatch.setattr(
+        "music_player_api.jobs.LEASE_RENEWAL_INTERVAL", timedelta(milliseconds=50)
+    )
+    leases = []
+
+    def _long_job():
+        time.sleep(0.5)
+        leases.append(Job.objects.get().run_after)
+
+    monkeypatch.setitem(_handlers, "long_job", _long_job)
+    enqueue("long_job")
+    job = claim_next_job()
+    assert run_job(job)
+    assert leases[0] > job.run_after
+
+
+@pytest.mark.django_db
+def test_failing_job_deleted_meanwhile(song_factory):
+    song = song_factory.create()
+    song.cover_img.name = "missing/cover.png"
+    song.save()
+    enqueue("process_song_media", song_id=song.id)
+    job = claim_next_job()
+    Job.objects.filter(pk=job.pk).delete()
+    assert run_job(job) is False
+    assert not Job.objects.exists()
+
+
+@pytest.mark.django_db
+def test_song_stream_byte_ranges(
+    client, auth_headers, local_storage, song_factory, audio_upload, settings
+):
+    settings.MEDIA_STREAM_CHUNK_SIZE = 100
+    song = song_factory.create()
+    audio = audio_upload()
+    song.audio_file.save("song.mp3", audio)
+    audio.seek(0)
+    content = audio.read()
+    size = len(content)
+    headers = auth_headers(song.added_by)
+    url = f"/api/songs/{song.id}/stream/"
+
+    response = client.get(url, **headers)
+    assert response.status_code == 200
+    assert response["Content-Type"] == "audio/mpeg"
+    assert response["Accept-Ranges"] == "bytes"
+    assert b"".join(response.streaming_content) == content
+
+    for header, start, end in [
+        ("bytes=10-249", 10, 249),
+        ("bytes=1000-", 1000, size - 1),
+        ("bytes=-300", size - 300, size - 1),
+        (f"bytes=0-{size + 100}", 0, size - 1),
+    ]:
+        response = client.get(url, HTTP_RANGE=header, **headers)
+        assert response.status_code == 206
+        assert response["Content-Range"] == f"bytes {start}-{end}/{size}"
+        assert int(response["Content-Length"]) == end - start + 1
+        assert b"".join(response.streaming_content) == content[start : end + 1]
+
+    response = client.get(url, HTTP_RANGE=f"bytes={size}-", **headers)
+    assert response.status_code == 416
+    assert response["Content-Range"] == f"bytes */{size}"
+
+    # multiple ranges are answered with the whole file
+    response = client.get(url, HTTP_RANGE="bytes=0-1,5-6", **headers)
+    assert response.status_code == 200
+
+    assert client.get(url).status_code == 401
+
+
+@pytest.mark.django_db
+def test_song_stream_without_a_file(
+    client, auth_headers, local_storage, song_factory, audio_upload, rf
+):
+    song = song_factory.create(audio_file="")
+    response = client.get(
+        f"/api/songs/{song.id}/stream/", **auth_headers(song.added_by)
+    )
+    assert response.status_code == 404
+
+    song.audio_file.save("song.mp3", audio_upload())
+    directory = os.path.dirname(song.audio_file.name)
+    for name in ["", directory, directory + "/"]:
+        with pytest.raises(Http404):
+            serve_media(rf.get("/"), name)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("header", ["X-Accel-Redirect", "X-Sendfile"])
+def test_song_stream_offloaded(
+    client, auth_headers, local_storage, song_factory, audio_upload, settings, header
+):
+    settings.MEDIA_OFFLOAD_HEADER = header
+    song = song_factory.create()
+    song.audio_file.save("song.mp3", audio_upload())
+
+    response = client.get(
+        f"/api/songs/{song.id}/stream/",
+        HTTP_RANGE="bytes=0-99",
+        **auth_headers(song.added_by),
+    )
+    assert response.status_code == 200
+    assert response.content == b""
+    if header == "X-Accel-Redirect":
+        assert response[header] == "/protected-media/" + song.audio_file.name
+    else:
+        assert response[header] == default_storage.path(song.audio_file.name)
+
+
+@pytest.mark.django_db
+def test_song_stream_redirects_to_remote_storage(
+    client, auth_headers, song_factory, monkeypatch
+):
+    class RemoteStorage(Storage):
+        def url(self, name):
+            return f"https://cdn.example.com/{name}"
+
+        def size(self, name):
+            pytest.fail("size requested from the remote storage")
+
+        def _open(self, name, mode="rb"):
+            pytest.fail("downloaded from the remote storage")
+
+    monkeypatch.setattr("music_player_api.streaming.storage", RemoteStorage())
+    song = song_factory.create(audio_file="uploads/blobs/aa/aa.mp3")
+
+    response = client.get(
+        f"/api/songs/{song.id}/stream/",
+        HTTP_RANGE="bytes=0-99",
+        **auth_headers(song.added_by),
+    )
+    assert response.status_code == 302
+    assert response["Location"] == "https://cdn.example.com/uploads/blobs/aa/aa.mp3"
+
+
+@pytest.mark.django_db
+def test_audio_renditions(
+    django_capture_on_commit_callbacks,
+    local_storage,
+    song_factory,
+    audio_upload,
+    settings,
+):
+    settings.AUDIO_RENDITION_BITRATES = [64, 128]
+    song = song_factory.create()
+    # about 8 seconds, two segments
+    song.audio_file.save("song.mp3", audio_upload(frames=300))
+    enqueue("transcode_song_audio", song_id=song.id)
+    assert run_pending_jobs() == 1
+
+    song.refresh_from_db()
+    renditions = song.audio_renditions
+    with default_storage.open(renditions["master"], "r") as master:
+        assert master.read().splitlines() == [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            '#EXT-X-STREAM-INF:BANDWIDTH=64000,CODECS="mp4a.40.2"',
+            "64k.m3u8",
+            '#EXT-X-STREAM-INF:BANDWIDTH=128000,CODECS="mp4a.40.2"',
+            "128k.m3u8",
+        ]
+    for bitrate, name in renditions["renditions"].items():
+        assert name == os.path.join(
+            os.path.dirname(renditions["master"]), f"{bitrate}k.m3u8"
+        )
+        with default_storage.open(name, "r") as playlist:
+            segments = [
+                line for line in playlist.read().splitlines() if line.endswith(".ts")
+            ]
+        assert segments == [f"{bitrate}k_0000.ts", f"{bitrate}k_0001.ts"]
+    assert len(renditions["files"]) == 7
+    assert all(default_storage.exists(name) for name in renditions["files"])
+
+    with django_capture_on_commit_callbacks(execute=True):
+        song.delete()
+    assert all(default_storage.exists(name) for name in renditions["files"])
+    run_pending_jobs()
+    assert not any(default_storage.exists(name) for name in renditions["files"])
+
+
+@pytest.mark.django_db
+def test_audio_renditions_on_renaming_storage(
+    local_storage, song_factory, audio_upload, settings, monkeypatch
+):
+    settings.AUDIO_RENDITION_BITRATES = [64]
+    song = song_factory.create()
+    song.audio_file.save("song.mp3", audio_upload(frames=300))
+
+    def _get_available_name(name, max_length=None):
+        root, extension = os.path.splitext(name)
+        return f"{root}_x1y2{extension}"
+
+    monkeypatch.setattr(default_storage, "get_available_name", _get_available_name)
+    enqueue("transcode_song_audio", song_id=song.id)
+    assert run_pending_jobs() == 1
+
+    song.refresh_from_db()
+    renditions = song.audio_renditions
+    assert renditions["renditions"]["64"].endswith("/64k_x1y2.m3u8")
+    with default_storage.open(renditions["master"], "r") as master:
+        assert master.read().splitlines()[-1] == "64k_x1y2.m3u8"
+    with default_storage.open(renditions["renditions"]["64"], "r") as playlist:
+        segments = [
+            line for line in playlist.read().splitlines() if line.endswith(".ts")
+        ]
+    assert segments == ["64k_0000_x1y2.ts", "64k_0001_x1y2.ts"]
+    directory = os.path.dirname(renditions["master"])
+    assert all(
+        default_storage.exists(os.path.join(directory, segment)) for segment in segments
+    )
+
+
+@pytest.mark.django_db
+def test_backfill_audio_metadata(
+    django_assert_num_queries, local_storage, song_factory, audio_upload
+):
+    songs = song_factory.create_batch(3)
+    for song in songs[:2]:
+        song.audio_file.save("song.mp3", audio_upload(frames=100))
+    songs[2].audio_file.save("song.mp3", SimpleUploadedFile("song.mp3", b"junk"))
+    output = StringIO()
+
+    # a select per batch and the last empty one, an update per readable song
+    with django_assert_num_queries(6):
+        call_command("backfill_audio_metadata", workers=2, batch_size=1, stdout=output)
+
+    assert output.getvalue().strip() == "Updated 2 song(s), 1 unreadable."
+    for song in songs[:2]:
+        song.refresh_from_db()
+        assert song.codec == "mp3" and song.bitrate == 128000
+        assert song.duration == pytest.approx(100 * 1152 / 44100, abs=0.05)
+    songs[2].refresh_from_db()
+    assert songs[2].duration is None and songs[2].codec == ""
+
+
+@pytest.mark.django_db
+def test_import_songs_from_directory(
+    local_storage, tmp_path, user_factory, audio_upload, image_upload
+):
+    user = user_factory.create()
+    album = tmp_path / "library" / "album"
+    album.mkdir(parents=True)
+    (album / "one.mp3").write_bytes(audio_upload(frames=100).read())
+    (album / "two.mp3").write_bytes(audio_upload(frames=200).read())
+    (album / "notes.mp3").write_bytes(b"not audio")
+    (album / "cover.png").write_bytes(image_upload(size=(400, 400)).read())
+    library = str(tmp_path / "library")
+    output, errors = StringIO(), StringIO()
+
+    call_command(
+        "import_songs",
+        library,
+        user=user.email,
+        workers=2,
+        uploads=2,
+        batch_size=1,
+        stdout=output,
+        stderr=errors,
+    )
+
+    assert "Imported 2 song(s), 1 rejected." in output.getvalue()
+    assert "album/notes.mp3: Unsupported file type." in errors.getvalue()
+    songs = list(Song.objects.order_by("title"))
+    assert [song.title for song in songs] == ["one", "two"]
+    assert songs[0].added_by == user and songs[0].codec == "mp3"
+    assert songs[0].cover_img.name == songs[1].cover_img.name
+    assert MediaBlob.objects.get(name=songs[0].cover_img.name).ref_count == 2
+    for song in songs:
+        assert default_storage.exists(song.audio_file.name)
+        assert default_storage.exists(song.thumbnail.name)
+        assert set(song.cover_variants) == {"64", "150", "300"}
+    assert Song.objects.search(build_search_query("two")).get() == songs[1]
+    assert Job.objects.filter(name="transcode_song_audio").count() == 2
+
+    # a second run only retries the rejected file
+    call_command("import_songs", library, user=user.email, stdout=output)
+    assert "1 track(s) to import, 2 imported before." in output.getvalue()
+    assert Song.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_import_songs_from_manifest(
+    local_storage, tmp_path, user_factory, genre_factory, audio_upload
+):
+    user = user_factory.create()
+    rock = genre_factory.create(name="Rock")
+    (tmp_path / "song.mp3").write_bytes(audio_upload().read())
+    manifest = tmp_path / "catalog.csv"
+    manifest.write_text(
+        "audio,title,author,genres,lyrics,cover\n"
+        "song.mp3,Title,Author,Rock;Jazz,La la,\n"
+    )
+
+    call_command(
+        "import_songs", str(manifest), user=user.email, workers=1, stdout=StringIO()
+    )
+
+    song = Song.objects.get()
+    assert (song.title, song.author, song.lyrics) == ("Title", "Author", "La la")
+    assert not song.cover_img and song.cover_variants == {}
+    assert {genre.name for genre in song.genres.all()} == {"Rock", "Jazz"}
+    assert rock.songs.get() == song
+    with open(f"{manifest}.progress") as progress:
+        assert json.loads(progress.read()) == {"key": "song.mp3", "song": song.id}
+
+
+@pytest.mark.django_db
+def test_song_waveform(
+    client, auth_headers, local_storage, song_factory, audio_upload, settings
+):
+    settings.AUDIO_RENDITION_BITRATES = [64]
+    settings.WAVEFORM_BUCKETS = 100
+    song = song_factory.create()
+    # one second of silence, then one second of a loud square wave
+    samples = [0] * 8000 + [16384, -16384] * 4000
+    wav = BytesIO()
+    with wave.open(wav, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(8000)
+        wav_file.writeframes(struct.pack(f"<{len(samples)}h", *samples))
+    song.audio_file.save("song.wav", SimpleUploadedFile("song.wav", wav.getvalue()))
+    headers = auth_headers(song.added_by)
+    url = f"/api/songs/{song.id}/waveform/"
+
+    assert client.get(url, **headers).status_code == 404
+
+    enqueue("transcode_song_audio", song_id=song.id)
+    assert run_pending_jobs() == 1
+
+    response = client.get(url, **headers)
+    assert response.status_code == 200
+    assert response["Content-Type"] == "application/octet-stream"
+    assert "max-age=31536000" in response["Cache-Control"]
+    peaks = response.content
+    assert len(peaks) == 100
+    assert max(peaks[:45]) < 5
+    assert all(120 <= peak <= 135 for peak in peaks[55:])
+
+
+@pytest.mark.django_db
+def test_uploads_are_deduplicated(
+    client,
+    auth_headers,
+    django_capture_on_commit_callbacks,
+    local_storage,
+    user_factory,
+    genre_factory,
+    audio_upload,
+    image_upload,
+):
+    genre = genre_factory.create()
+    songs = []
+    for user in user_factory.create_batch(2):
+        response = client.post(
+            "/api/songs/",
+            data={
+                "title": "Song",
+                "author": "Author",
+                "genres": [genre.id],
+                "audioFile": audio_upload(),
+                "coverImg": image_upload(),
+            },
+            **auth_headers(user),
+        )
+        assert response.status_code == 201
+        songs.append(Song.objects.get(pk=response.json()["id"]))
+
+    audio_name = songs[0].audio_file.name
+    cover_name = songs[0].cover_img.name
+    assert songs[1].audio_file.name == audio_name
+    assert songs[1].cover_img.name == cover_name
+    assert MediaBlob.objects.get(name=audio_name).ref_count == 2
+    assert MediaBlob.objects.count() == 2
+
+    # re-uploading the same cover keeps a single reference
+    response = client.patch(
+        f"/api/songs/{songs[0].id}/",
+        data=encode_multipart(BOUNDARY, {"coverImg": image_upload()}),
+        content_type=MULTIPART_CONTENT,
+        **auth_headers(songs[0].added_by),
+    )
+    assert response.status_code == 200
+    assert MediaBlob.objects.get(name=cover_name).ref_count == 2
+
+    songs[0].delete()
+    assert MediaBlob.objects.get(name=audio_name).ref_count == 1
+    assert default_storage.exists(audio_name)
+    with django_capture_on_commit_callbacks(execute=True):
+        songs[1].delete()
+    assert not MediaBlob.objects.exists()
+    run_pending_jobs()
+    assert not default_storage.exists(audio_name)
+    assert not default_storage.exists(cover_name)
+
+
+@pytest.mark.django_db
+def test_failed_song_upload_takes_no_blob_reference(
+    client,
+    auth_headers,
+    local_storage,
+    song_factory,
+    genre_factory,
+    audio_upload,
+    image_upload,
+    monkeypatch,
+):
+    song = song_factory.create()
+    headers = auth_headers(song.added_by)
+
+    def _enqueue(name, **payload):
+        raise RuntimeError("queue unavailable")
+
+    monkeypatch.setattr("music_player_api.serializers.enqueue", _enqueue)
+    with pytest.raises(RuntimeError):
+        client.post(
+            "/api/songs/",
+            data={
+                "title": "Song",
+                "author": "Author",
+                "genres": [genre_factory.create().id],
+                "audioFile": audio_upload(),
+                "coverImg": image_upload(),
+            },
+            **headers,
+        )
+    with pytest.raises(RuntimeError):
+        client.patch(
+            f"/api/songs/{song.id}/",
+            data=encode_multipart(BOUNDARY, {"coverImg": image_upload()}),
+            content_type=MULTIPART_CONTENT,
+            **headers,
+        )
+    assert Song.objects.get() == song
+    assert not MediaBlob.objects.exists()
+    assert not os.listdir(local_storage.parent / "spool")
+
+
+@pytest.mark.django_db
+def test_blob_keeps_the_name_given_by_the_storage(
+    local_storage, audio_upload, monkeypatch
+):
+    def _get_available_name(name, max_length=None):
+        root, extension = os.path.splitext(name)
+        return f"{root}_x1y2{extension}"
+
+    monkeypatch.setattr(default_storage, "get_available_name", _get_available_name)
+    name = MediaBlob.objects.store(audio_upload())
+    assert name.endswith("_x1y2.mp3")
+    assert default_storage.exists(name)
+    assert MediaBlob.objects.store(audio_upload()) == name
+    assert MediaBlob.objects.get().ref_count == 2
+
+
+@pytest.mark.django_db
+def test_files_stored_before_deduplication_are_deleted(
+    django_capture_on_commit_callbacks, local_storage, song_factory, audio_upload
+):
+    song = song_factory.create()
+    song.audio_file.save("song.mp3", audio_upload())
+    name = song.audio_file.name
+    assert default_storage.exists(name)
+    with django_capture_on_commit_callbacks(execute=True):
+        song.delete()
+    assert DeletedFile.objects.filter(name=name).exists()
+    run_pending_jobs()
+    assert not default_storage.exists(name)
+    assert not DeletedFile.objects.exists()
+
+
+@pytest.mark.django_db
+def test_file_deletions_of_rolled_back_savepoints_are_dropped(
+    django_capture_on_commit_callbacks,
+):
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        schedule_file_deletion(["kept.mp3"])
+        schedule_file_deletion(["kept.jpg"])
+        with pytest.raises(RuntimeError):
+            with transaction.atomic():
+                schedule_file_deletion(["rolled-back.mp3"])
+                raise RuntimeError
+        schedule_file_deletion(["", "also-kept.mp3"])
+    # one batch before the savepoint and one after it
+    assert len(callbacks) == 2
+    assert set(DeletedFile.objects.values_list("name", flat=True)) == {
+        "kept.mp3",
+        "kept.jpg",
+        "also-kept.mp3",
+    }
+
+
+@pytest.mark.django_db
+def test_saving_a_song_does_not_reload_it(
+    django_assert_num_queries,
+    django_capture_on_commit_callbacks,
+    local_storage,
+    song_factory,
+    image_upload,
+):
+    song = song_factory.create()
+    song.cover_img = MediaBlob.objects.store(image_upload())
+    song.save()
+    song = Song.objects.get(pk=song.pk)
+    old_name = song.cover_img.name
+
+    with django_assert_num_queries(1):
+        song.save(update_fields=["processing_status"])
+
+    song.cover_img = None
+    with django_capture_on_commit_callbacks(execute=True):
+        song.save()
+    assert not MediaBlob.objects.exists()
+    assert DeletedFile.objects.get().name == old_name
+
+
+@pytest.mark.django_db
+def test_bulk_delete_songs(
+    client,
+    auth_headers,
+    django_capture_on_commit_callbacks,
+    local_storage,
+    song_factory,
+    audio_upload,
+    settings,
+):
+    settings.DELETION_BATCH_SIZE = 2
+    songs = song_factory.create_batch(5)
+    user = songs[0].added_by
+    for song in songs[1:3]:
+        song.added_by = user
+        song.save()
+    songs[0].audio_file = MediaBlob.objects.store(audio_upload())
+    songs[0].save()
+    headers = auth_headers(user)
+
+    response = client.post(
+        "/api/songs/bulk-delete/",
+        {"songIds": [songs[0].id, songs[3].id]},
+        content_type="application/json",
+        **headers,
+    )
+    assert response.status_code == 400
+    assert response.json()["errors"] == [
+        f"Songs [{songs[3].id}] do not exist or are not yours."
+    ]
+
+    response = client.post(
+        "/api/songs/bulk-delete/",
+        {"songIds": [song.id for song in songs[:3]]},
+        content_type="application/json",
+        **headers,
+    )
+    assert response.status_code == 202
+    assert Song.objects.count() == 5
+    with django_capture_on_commit_callbacks(execute=True):
+        assert run_pending_jobs(limit=1) == 1
+    assert set(Song.objects.values_list("pk", flat=True)) == {
+        song.id for song in songs[3:]
+    }
+    assert not MediaBlob.objects.exists()
+    run_pending_jobs()
+    assert not default_storage.exists(songs[0].audio_file.name)
+
+
+@pytest.mark.django_db
+def test_files_in_use_are_not_swept(local_storage, song_factory, audio_upload):
+    song = song_factory.create()
+    song.audio_file = MediaBlob.objects.store(audio_upload())
+    song.save()
+    # queued by mistake, e.g. by a reconciliation racing with an upload
+    DeletedFile.objects.create(name=song.audio_file.name)
+    enqueue("sweep_deleted_files")
+    run_pending_jobs()
+    assert default_storage.exists(song.audio_file.name)
+    assert not DeletedFile.objects.exists()
+
+
+@pytest.mark.django_db
+def test_failed_sweep_keeps_files_queued(
+    django_capture_on_commit_callbacks, local_storage, song_factory, monkeypatch
+):
+    song = song_factory.create()
+    song.cover_img.save("cover.png", ContentFile(b"cover"))
+    with django_capture_on_commit_callbacks(execute=True):
+        song.delete()
+
+    def _delete(name):
+        raise OSError("storage unavailable")
+
+    monkeypatch.setattr(default_storage, "delete", _delete)
+    job = claim_next_job()
+    assert job.name == "sweep_deleted_files"
+    assert not run_job(job)
+    assert DeletedFile.objects.filter(name=song.cover_img.name).exists()
+
+    monkeypatch.undo()
+    Job.objects.update(run_after=timezone.now())
+    run_pending_jobs()
+    assert not default_storage.exists(song.cover_img.name)
+    assert not DeletedFile.objects.exists()
+
+
+@pytest.mark.django_db
+def test_reconcile_media_queues_orphaned_files(local_storage, song_factory):
+    song = song_factory.create()
+    song.cover_img.save("cover.png", ContentFile(b"cover"))
+    orphan = default_storage.save(
+        f"uploads/songs/{song.id}/hls/64k_0000.ts", ContentFile(b"segment")
+    )
+    stdout = StringIO()
+    call_command("reconcile_media", "--grace", "1", stdout=stdout)
+    assert "2 file(s), 1 queued" in stdout.getvalue()
+    deleted = DeletedFile.objects.get()
+    assert deleted.name == orphan
+    assert deleted.delete_after > timezone.now()
+
+    # nothing is due yet
+    Job.objects.update(run_after=timezone.now())
+    run_pending_jobs()
+    assert default_storage.exists(orphan)
+    DeletedFile.objects.update(delete_after=timezone.now())
+    Job.objects.update(run_after=timezone.now())
+    run_pending_jobs()
+    assert not default_storage.exists(orphan)
+    assert default_storage.exists(song.cover_img.name)
+
+
+@pytest.mark.django_db
+def test_derived_files_with_prefixed_names_are_not_swept(local_storage, song_factory):
+    # Cloudinary returns the stored names with its media prefix prepended
+    song = song_factory.create()
+    directory = f"media/uploads/songs/{song.id}"
+    cover = default_storage.save(f"{directory}/cover_300.webp", ContentFile(b"c"))
+    playlist = default_storage.save(f"{directory}/hls/64k.m3u8", ContentFile(b"p"))
+    orphan = default_storage.save(f"{directory}/hls/64k_0000.ts", ContentFile(b"s"))
+    song.cover_variants = {"300": {"webp": cover}}
+    song.audio_renditions = {"master": playlist, "files": [playlist]}
+    song.save()
+
+    DeletedFile.objects.bulk_create(
+        [DeletedFile(name=name) for name in [cover, playlist, orphan]]
+    )
+    enqueue("sweep_deleted_files")
+    run_pending_jobs()
+    assert default_storage.exists(cover)
+    assert default_storage.exists(playlist)
+    assert not default_storage.exists(orphan)
+    assert not DeletedFile.objects.exists()
+
+
+@pytest.mark.django_db
+def test_media_urls_are_resolved_once_per_file(
+    client, auth_headers, local_storage, song_factory, monkeypatch
+):
+    MediaURLCache.clear()
+    cache.clear()
+    songs = song_factory.create_batch(5, audio_file="uploads/blobs/aa/aa.mp3")
+    songs[0].cover_img = "uploads/blobs/bb/bb.png"
+    songs[0].save()
+    resolved = []
+    storage_url = default_storage.url
+
+    def _url(name):
+        resolved.append(name)
+        return storage_url(name)
+
+    monkeypatch.setattr(default_storage, "url", _url)
+    for _ in range(2):
+        response = client.get("/api/all-songs/")
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert {song["audioFile"] for song in results} == {
+            "http://testserver/music_player_api/media/uploads/blobs/aa/aa.mp3"
+        }
+    assert sorted(resolved) == ["uploads/blobs/aa/aa.mp3", "uploads/blobs/bb/bb.png"]
+
+    # other processes pick the URLs up from the shared cache
+    MediaURLCache.clear()
+    client.get("/api/all-songs/")
+    assert len(resolved) == 2
+
+
+@pytest.mark.django_db
+def test_signed_media_urls(
+    client, auth_headers, local_storage, song_factory, audio_upload, settings
+):
+    MediaURLCache.clear()
+    settings.MEDIA_SIGNED_URLS = True
+    song = song_factory.create()
+    audio = audio_upload()
+    song.audio_file.save("song.mp3", audio)
+    default_storage.save("uploads/songs/1/hls/128k_0000.ts", ContentFile(b"segment"))
+    song.audio_renditions = {
+        "master": default_storage.save(
+            "uploads/songs/1/hls/master.m3u8", ContentFile(b"#EXTM3U")
+        ),
+        "renditions": {},
+        "files": [],
+    }
+    song.save()
+
+    response = client.get(f"/api/songs/{song.id}/", **auth_headers(song.added_by))
+    url = response.json()["audioFile"]
+    assert url.startswith("http://testserver/api/media/")
+    assert url.endswith("/" + song.audio_file.name)
+    audio.seek(0)
+    assert b"".join(client.get(url).streaming_content) == audio.read()
+
+    # a signature is valid for its file only
+    neighbour = default_storage.save(
+        os.path.join(os.path.dirname(song.audio_file.name), "other.mp3"),
+        ContentFile(b"other"),
+    )
+    neighbour_url = url.replace(song.audio_file.name, neighbour)
+    assert client.get(neighbour_url).status_code == 403
+    other_dir_url = url.replace("/uploads/", "/uploads/songs/1/hls/")
+    assert client.get(other_dir_url).status_code == 403
+
+    # except in HLS directories, where playlists refer to the segments
+    master_url = response.json()["hls"]["master"]
+    assert master_url.startswith("http://testserver/api/media/")
+    segment_url = master_url.replace("master.m3u8", "128k_0000.ts")
+    assert b"".join(client.get(segment_url).streaming_content) == b"segment"
+
+    expires, signature = url.split("/api/media/")[1].split("/")[:2]
+    assert client.get(url.replace(signature, "0" * 32)).status_code == 403
+    expired = int(expires) - settings.MEDIA_URL_TTL * 2
+    assert client.get(url.replace(expires, str(expired))).status_code == 403
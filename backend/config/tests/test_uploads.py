@@ -0,0 +1,240 @@
+import os
+from datetime import timedelta
+
+import pytest
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.core.handlers.exception import response_for_exception
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.utils import timezone
+from music_player_api.models import Song, UploadSession
+from music_player_api.uploadhandlers import ValidatingUploadHandler
+from music_player_api.utils import MAX_UPLOAD_SIZE, UploadRejected, validate_is_music
+
+
+def start_upload(client, headers, filename, size):
+    response = client.post(
+        "/api/uploads/",
+        data={"filename": filename, "size": size},
+        content_type="application/json",
+        **headers,
+    )
+    assert response.status_code == 201
+    assert response.json()["offset"] == 0
+    return response.json()["id"]
+
+
+def send_chunk(client, headers, upload_id, content, start, size):
+    return client.patch(
+        f"/api/uploads/{upload_id}/",
+        data=content,
+        content_type="application/octet-stream",
+        HTTP_CONTENT_RANGE=f"bytes {start}-{start + len(content) - 1}/{size}",
+        **headers,
+    )
+
+
+def upload_in_chunks(client, headers, upload, chunk_size):
+    content = upload.read()
+    upload_id = start_upload(client, headers, upload.name, len(content))
+    for start in range(0, len(content), chunk_size):
+        response = send_chunk(
+            client,
+            headers,
+            upload_id,
+            content[start : start + chunk_size],
+            start,
+            len(content),
+        )
+        assert response.status_code == 200
+    return upload_id
+
+
+@pytest.mark.django_db
+def test_chunked_upload_is_resumable(
+    client, auth_headers, local_storage, user_factory, audio_upload
+):
+    headers = auth_headers(user_factory.create())
+    content = audio_upload().read()
+    size = len(content)
+    upload_id = start_upload(client, headers, "song.mp3", size)
+
+    response = send_chunk(client, headers, upload_id, content[:50000], 0, size)
+    assert response.status_code == 200
+    assert response.json()["offset"] == 50000
+
+    # a chunk cut off by a dropped connection is not counted
+    response = client.patch(
+        f"/api/uploads/{upload_id}/",
+        data=content[50000:60000],
+        content_type="application/octet-stream",
+        HTTP_CONTENT_RANGE=f"bytes 50000-79999/{size}",
+        **headers,
+    )
+    assert response.status_code == 400
+    response = client.get(f"/api/uploads/{upload_id}/", **headers)
+    assert response.json()["offset"] == 50000
+
+    # chunks not continuing at the offset are refused
+    response = send_chunk(client, headers, upload_id, content[60000:], 60000, size)
+    assert response.status_code == 409
+    assert response.json()["offset"] == 50000
+
+    response = send_chunk(client, headers, upload_id, content[50000:], 50000, size)
+    assert response.json()["offset"] == size
+    session = UploadSession.objects.get(pk=upload_id)
+    with open(session.path, "rb") as part:
+        assert part.read() == content
+
+    # uploads of other users are not visible
+    other_headers = auth_headers(user_factory.create())
+    assert client.get(f"/api/uploads/{upload_id}/", **other_headers).status_code == 404
+
+
+@pytest.mark.django_db
+def test_create_song_from_chunked_uploads(
+    client,
+    auth_headers,
+    local_storage,
+    user_factory,
+    genre_factory,
+    audio_upload,
+    image_upload,
+):
+    user = user_factory.create()
+    headers = auth_headers(user)
+    audio_id = upload_in_chunks(client, headers, audio_upload(), 40000)
+    cover_id = upload_in_chunks(client, headers, image_upload(), 1000)
+    paths = [UploadSession.objects.get(pk=pk).path for pk in (audio_id, cover_id)]
+
+    response = client.post(
+        "/api/songs/",
+        data={
+            "title": "Song",
+            "author": "Author",
+            "genres": [genre_factory.create().id],
+            "audioUploadId": audio_id,
+            "coverUploadId": cover_id,
+        },
+        content_type="application/json",
+        **headers,
+    )
+    assert response.status_code == 201
+    song = Song.objects.get(pk=response.json()["id"])
+    assert song.audio_file.name.endswith(".mp3")
+    assert song.cover_img.name.endswith(".png")
+    assert song.codec == "mp3"
+    assert not UploadSession.objects.exists()
+    assert not any(os.path.exists(path) for path in paths)
+
+
+@pytest.mark.django_db
+def test_chunked_uploads_are_validated(
+    client, auth_headers, local_storage, user_factory, genre_factory, image_upload
+):
+    user = user_factory.create()
+    headers = auth_headers(user)
+
+    response = client.post(
+        "/api/uploads/",
+        data={"filename": "song.mp3", "size": 11 * 1024 * 1024},
+        content_type="application/json",
+        **headers,
+    )
+    assert response.status_code == 400
+
+    # an image is not accepted as audio
+    image_id = upload_in_chunks(client, headers, image_upload(name="song.mp3"), 100000)
+    incomplete_id = start_upload(client, headers, "song.mp3", 1000)
+    for upload_id, field in [(image_id, "audioFile"), (incomplete_id, "audioUploadId")]:
+        response = client.post(
+            "/api/songs/",
+            data={
+                "title": "Song",
+                "author": "Author",
+                "genres": [genre_factory.create().id],
+                "audioUploadId": upload_id,
+            },
+            content_type="application/json",
+            **headers,
+        )
+        assert response.status_code == 400
+        assert field in response.json()["oldRepr"]
+    assert not Song.objects.exists()
+
+    # abandoned uploads are discarded
+    UploadSession.objects.update(created_at=timezone.now() - timedelta(days=2))
+    start_upload(client, headers, "song.mp3", 1000)
+    assert UploadSession.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_bad_uploads_are_rejected_while_received(
+    client,
+    auth_headers,
+    local_storage,
+    user_factory,
+    genre_factory,
+    audio_upload,
+    image_upload,
+    monkeypatch,
+):
+    headers = auth_headers(user_factory.create())
+    genre = genre_factory.create()
+    received = []
+    receive_data_chunk = TemporaryFileUploadHandler.receive_data_chunk
+
+    def _receive_data_chunk(handler, raw_data, start):
+        received.append(len(raw_data))
+        return receive_data_chunk(handler, raw_data, start)
+
+    monkeypatch.setattr(
+        TemporaryFileUploadHandler, "receive_data_chunk", _receive_data_chunk
+    )
+    # about 12 MB
+    oversized = audio_upload(frames=30000)
+    for audio_file, cover_img, error in [
+        (oversized, None, "File is too large. Size should not exceed 10 MB."),
+        (image_upload(name="song.mp3"), None, "Unsupported file type."),
+        (audio_upload(name="song.exe"), None, "Unacceptable file extension."),
+        (audio_upload(), audio_upload(name="cover.png"), "Upload a valid image."),
+    ]:
+        data = {"title": "Song", "author": "Author", "genres": [genre.id]}
+        data["audioFile"] = audio_file
+        if cover_img is not None:
+            data["coverImg"] = cover_img
+        response = client.post("/api/songs/", data=data, **headers)
+        assert response.status_code == 400
+        assert response.json()["errors"] == [error]
+
+    # the oversized upload stopped right after the limit
+    assert sum(received) <= MAX_UPLOAD_SIZE
+    assert not Song.objects.exists()
+
+
+@pytest.mark.django_db
+def test_bad_avatar_is_rejected_while_received(
+    client, auth_headers, local_storage, user_factory, audio_upload
+):
+    response = client.patch(
+        "/api/users/settings/",
+        data=encode_multipart(BOUNDARY, {"avatar": audio_upload(name="avatar.png")}),
+        content_type=MULTIPART_CONTENT,
+        **auth_headers(user_factory.create()),
+    )
+    assert response.status_code == 400
+    assert response.json()["errors"] == ["Upload a valid image."]
+
+
+def test_rejected_upload_is_a_bad_request_outside_the_api(rf, audio_upload):
+    request = rf.post("/admin/", {"avatar": audio_upload(name="avatar.png")})
+    request.upload_handlers.insert(0, ValidatingUploadHandler(request))
+    with pytest.raises(UploadRejected) as rejected:
+        request.POST.get("avatar")
+    assert response_for_exception(request, rejected.value).status_code == 400
+
+
+def test_validate_is_music_rewinds(audio_upload):
+    upload = audio_upload()
+    upload.read(10)
+    validate_is_music(upload)
+    assert upload.tell() == 0
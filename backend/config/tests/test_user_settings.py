@@ -1,5 +1,9 @@
 import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from faker import Faker
+from music_player_api.jobs import run_pending_jobs
+from music_player_api.models import DeletedFile, Playlist, Song, User
 
 
 @pytest.mark.django_db
@@ -72,3 +76,86 @@ def test_user_settings(client, user_factory):
         and user_data["firstName"] == user.first_name
         and user_data["lastName"] == user.last_name
     )
+
+
+@pytest.mark.django_db
+def test_saving_a_user_does_not_reload_it(
+    django_assert_num_queries,
+    django_capture_on_commit_callbacks,
+    local_storage,
+    user_factory,
+):
+    user = user_factory.create()
+    user.avatar.save("avatar.png", ContentFile(b"avatar"))
+    user = User.objects.get(pk=user.pk)
+    old_name = user.avatar.name
+
+    user.first_name = "Name"
+    with django_assert_num_queries(1):
+        user.save()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        user.avatar.save("avatar.png", ContentFile(b"new avatar"))
+    assert DeletedFile.objects.get().name == old_name
+    # the new file is now the stored one
+    with django_capture_on_commit_callbacks(execute=True):
+        user.save()
+    assert DeletedFile.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_removed_avatar_is_queued_for_deletion(
+    client,
+    auth_headers,
+    django_capture_on_commit_callbacks,
+    local_storage,
+    user_factory,
+):
+    user = user_factory.create()
+    headers = auth_headers(user)
+    user.avatar.save("avatar.png", ContentFile(b"avatar"))
+    old_name = user.avatar.name
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.patch(
+            "/api/users/settings/",
+            data={"avatar": None},
+            content_type="application/json",
+            **headers,
+        )
+    assert response.status_code == 200
+    assert response.json()["avatar"] is None
+    assert default_storage.exists(old_name)
+    assert DeletedFile.objects.get().name == old_name
+    run_pending_jobs()
+    assert not default_storage.exists(old_name)
+
+
+@pytest.mark.django_db
+def test_delete_current_user(
+    client,
+    auth_headers,
+    django_capture_on_commit_callbacks,
+    settings,
+    user_factory,
+    song_factory,
+    playlist_factory,
+):
+    settings.DELETION_BATCH_SIZE = 2
+    user = user_factory.create()
+    song_factory.create_batch(5, added_by=user)
+    playlist_factory.create_batch(3, added_by=user)
+    other_song = song_factory.create()
+    headers = auth_headers(user)
+
+    response = client.delete("/api/users/settings/", **headers)
+    assert response.status_code == 204
+    user.refresh_from_db()
+    assert not user.is_active
+    assert client.get("/api/users/settings/", **headers).status_code == 401
+
+    with django_capture_on_commit_callbacks(execute=True):
+        assert run_pending_jobs() >= 1
+    assert not User.objects.filter(pk=user.pk).exists()
+    assert list(Song.objects.all()) == [other_song]
+    assert not Playlist.objects.exists()